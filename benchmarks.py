@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+import timeit
+import numpy as np
+from services import calculate_TL_loop, calculate_TL_vectorized
+
+ZONE_LIMITS = [130, 145, 160, 175]
+
+#budżet czasu importu aplikacji - przekroczenie kończy benchmark kodem 1
+IMPORT_TIME_BUDGET_MS = float(os.getenv('IMPORT_TIME_BUDGET_MS', 1500))
+LAZY_MODULES = ('pandas',)
+
+#minimalna przepustowość synchronizacji na serwerze zastępczym (ok. 1/3 typowego wyniku), 0 wyłącza kontrolę
+SYNC_MIN_ACTIVITIES_PER_S = float(os.getenv('SYNC_MIN_ACTIVITIES_PER_S', 10))
+SYNC_ATHLETE_ID = 1
+
+def synthetic_streams(hours, seed=0):
+    #1 Hz z losowymi przerwami w zapisie, tętno faluje wokół 145 bpm
+    rng = np.random.default_rng(seed)
+    samples = int(hours * 3600)
+    time_data = np.cumsum(rng.choice([1, 1, 1, 2, 5], size=samples)) - 1
+    hr_data = (145 + 25 * np.sin(time_data / 600) + rng.normal(0, 3, size=samples)).astype(int)
+    return {
+        'hr_data': hr_data.tolist(),
+        'time_data': time_data.tolist()
+    }
+
+def bench_training_load(hours_list=(1, 3, 6), repeat=5):
+    for hours in hours_list:
+        streams = synthetic_streams(hours)
+        hr_data, time_data = streams['hr_data'], streams['time_data']
+
+        loop_result = calculate_TL_loop(hr_data, time_data, ZONE_LIMITS)
+        vec_result = calculate_TL_vectorized(hr_data, time_data, ZONE_LIMITS)
+        assert loop_result == vec_result, f"TL mismatch: {loop_result} != {vec_result}"
+
+        loop_time = min(timeit.repeat(lambda: calculate_TL_loop(hr_data, time_data, ZONE_LIMITS), number=1, repeat=repeat))
+        vec_time = min(timeit.repeat(lambda: calculate_TL_vectorized(hr_data, time_data, ZONE_LIMITS), number=1, repeat=repeat))
+        print(f"training load {hours}h ({len(hr_data)} samples): "
+              f"loop {loop_time * 1000:.2f} ms, numpy {vec_time * 1000:.2f} ms, "
+              f"speedup x{loop_time / vec_time:.1f}, TL={vec_result}")
+
+def measure_import_time(module='main'):
+    #python -X importtime wypisuje na stderr: self [us] | cumulative [us] | moduł,
+    #a na stdout trafiają moduły z LAZY_MODULES obecne w sys.modules po imporcie
+    check = f"import sys, {module}; print(','.join(name for name in {LAZY_MODULES!r} if name in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', check],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        try:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            modules[name.strip()] = int(cumulative)
+        except ValueError:
+            continue
+    eager = [name for name in result.stdout.strip().split(',') if name]
+    return modules, eager
+
+def bench_import_time(module='main', budget_ms=IMPORT_TIME_BUDGET_MS):
+    modules, eager = measure_import_time(module)
+    total_ms = modules[module] / 1000
+    heaviest = sorted(((cumulative, name) for name, cumulative in modules.items() if '.' not in name and name != module), reverse=True)[:10]
+
+    print(f"import {module}: {total_ms:.0f} ms (budget {budget_ms:.0f} ms)")
+    for cumulative, name in heaviest:
+        print(f"  {name:<24} {cumulative / 1000:8.1f} ms")
+
+    if eager:
+        print(f"modules that should be imported lazily: {', '.join(eager)}")
+    if total_ms > budget_ms or eager:
+        sys.exit(1)
+
+def measure_sync(activities=200, samples=3600, latency=0.02):
+    #synchronizacja end to end na strava_stub, w osobnym procesie - DATABASE_URL i STRAVA_BASE_URL
+    #są czytane przy imporcie modułów, więc muszą być ustawione przed nim
+    from strava_stub import StravaStub
+
+    stub = StravaStub(activities=activities, samples=samples, latency=latency).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                STRAVA_BASE_URL=stub.url,
+                STRAVA_SHORT_LIMIT=str(10 ** 9),
+                STRAVA_DAILY_LIMIT=str(10 ** 9),
+                DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                STREAM_STORE_DIR=os.path.join(tmp, 'streams')
+            )
+            result = subprocess.run(
+                [sys.executable, '-c', 'import json, benchmarks; print(json.dumps(benchmarks.run_sync()))'],
+                capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+    finally:
+        stub.stop()
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['rate'] = report['activities'] / report['sync_s'] if report['sync_s'] else 0.0
+    return report
+
+def bench_sync(activities=200, samples=3600, latency=0.02, min_rate=SYNC_MIN_ACTIVITIES_PER_S):
+    report = measure_sync(activities, samples, latency)
+    print(f"sync {report['activities']} activities x {samples} samples, {latency * 1000:.0f} ms latency: "
+          f"{report['rate']:.1f} activities/s ({report['sync_s']:.2f} s, minimum {min_rate:.1f}/s)")
+    print(f"  {report['requests']} requests, latency p50 {report['p50_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms, "
+          f"peak memory {report['peak_mb']:.1f} MB ({report['start_mb']:.1f} MB before the sync)")
+    if report['activities'] != activities or report['rate'] < min_rate:
+        sys.exit(1)
+
+def run_sync(ath_id=SYNC_ATHLETE_ID):
+    #część bench_sync wykonywana w procesie potomnym - ta sama ścieżka co zadanie "upload" w aplikacji
+    #(strona po stronie: save_page, rollupy, zapis streams); pamięć z ru_maxrss, bez narzutu tracemalloc
+    import resource
+    import strava_client as client
+    from database import engine
+    from migrations import migrate
+    from db_logic import insert_user, update_HRzones
+    from strava_services import sync_activities
+
+    migrate(engine)
+    insert_user({
+        'athlete_id': ath_id,
+        'name': 'benchmark',
+        'gender': 'M',
+        'access_token': f"stub-{ath_id}",
+        'refresh_token': f"stub-refresh-{ath_id}",
+        'expires_at': int(time.time()) + 6 * 3600
+    })
+    z1, z2, z3, z4 = ZONE_LIMITS
+    update_HRzones(ath_id, {'z1': z1, 'z2': z2, 'z3': z3, 'z4': z4, 'hr_max': 190})
+
+    latencies = []
+    client.get_http_session().hooks['response'].append(
+        lambda response, *args, **kwargs: latencies.append(response.elapsed.total_seconds())
+    )
+
+    #ru_maxrss w KB na Linuksie
+    start_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    result = sync_activities(ath_id, '2019-12-31', '2100-01-01')
+    finished = time.perf_counter()
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if result['status'] != 'success':
+        raise RuntimeError(result['message'])
+    return {
+        'activities': result['count'],
+        'requests': len(latencies),
+        'sync_s': finished - started,
+        'p50_ms': float(np.percentile(latencies, 50)) * 1000 if latencies else 0.0,
+        'p99_ms': float(np.percentile(latencies, 99)) * 1000 if latencies else 0.0,
+        'start_mb': start_kb / 1024,
+        'peak_mb': peak_kb / 1024
+    }
+
+BENCHMARKS = {
+    'training_load': bench_training_load,
+    'import_time': bench_import_time,
+    'sync': bench_sync,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Performance benchmarks")
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(sorted(unknown))}")
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
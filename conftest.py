@@ -0,0 +1 @@
+#katalog główny repozytorium na sys.path, żeby testy importowały moduły aplikacji
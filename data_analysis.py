@@ -1,14 +1,16 @@
-import pandas as pd
-from models import init_db
-from datetime import date, timedelta
-from db_logic import get_period_activities, get_user_activities, get_user_blocks
+import json
+import numpy as np
+from database import engine
+from datetime import date
+from db_logic import get_user_activities, get_user_blocks, get_data_version, get_weekly_rollups, get_activity_row, get_lap_rows
 from services import time_toString
-import plotly.express as px
-import plotly.io as pio
+from fragment_cache import fragment_cache, athlete_tag
+from metrics import timed
 
-engine = init_db()
+#pandas importowany leniwie w funkcjach - szybszy start aplikacji
 
 def get_activities_data(ath_id):
+    import pandas as pd
     stmt = get_user_activities(ath_id)
     
     with engine.connect() as connection:
@@ -17,6 +19,7 @@ def get_activities_data(ath_id):
     return df_act
 
 def get_blocks_data(ath_id):
+    import pandas as pd
     stmt = get_user_blocks(ath_id)
     
     with engine.connect() as connection:
@@ -25,6 +28,7 @@ def get_blocks_data(ath_id):
     return df_blocks
 
 def get_weekly_grid(df_activities):
+    import pandas as pd
     df_activities = df_activities.sort_values(by='date', ascending=True)
 
     df_activities['link'] = df_activities.apply(
@@ -51,6 +55,7 @@ def get_weekly_grid(df_activities):
     return grid.to_html(escape=False, classes="table")
 
 def get_block_table(df_filtered, start_date):
+    import pandas as pd
     if df_filtered.empty:
         return "<p class='text-muted'>No activities in this block.</p>"
     
@@ -77,33 +82,75 @@ def get_block_table(df_filtered, start_date):
     
     return grid.to_html(escape=False, classes="table table-striped")
 
-def get_calendar_blocks(ath_id):
+def get_calendar_model(ath_id):
+    #model kalendarza w fragment_cache - ten sam limit pamięci i unieważnianie co fragmenty HTML
+    ath_id = int(ath_id)
+    version = get_data_version(ath_id)
+    key = ('calendar_model', ath_id, version)
+    return fragment_cache.get_or_build(key, lambda: build_calendar_model(ath_id, version), [athlete_tag(ath_id)])
+
+def build_calendar_model(ath_id, version):
+    import pandas as pd
     df_activities = get_activities_data(ath_id)
     df_blocks = get_blocks_data(ath_id)
 
     df_activities['date'] = pd.to_datetime(df_activities['date'])
+    df_activities = df_activities.sort_values(by='date', ascending=True).reset_index(drop=True)
     df_blocks['start_date'] = pd.to_datetime(df_blocks['start_date'])
     df_blocks['end_date'] = pd.to_datetime(df_blocks['end_date'])
     df_blocks = df_blocks.sort_values(by='start_date', ascending=False)
-    
-    df_unassigned = df_activities.copy()
+
+    #aktywności posortowane po dacie - każdy blok to przedział [lo, hi) w tablicy
+    dates = df_activities['date'].to_numpy()
+    lo = np.searchsorted(dates, df_blocks['start_date'].to_numpy(), side='left')
+    hi = np.searchsorted(dates, df_blocks['end_date'].to_numpy(), side='right')
+
+    coverage = np.zeros(len(dates) + 1, dtype=np.int64)
+    np.add.at(coverage, lo, 1)
+    np.add.at(coverage, hi, -1)
+    assigned = np.cumsum(coverage[:-1]) > 0
+
+    blocks = []
+    for block, block_lo, block_hi in zip(df_blocks.itertuples(index=False), lo, hi):
+        blocks.append({
+            "name": block.name,
+            "start_date": block.start_date,
+            "end_date": block.end_date,
+            "block_id": block.block_id,
+            "lo": int(block_lo),
+            "hi": int(block_hi)
+        })
+
+    #bloki trzymają tylko granice przedziałów, żeby rozmiar wpisu w cache liczył każdą ramkę raz
+    return {
+        'version': version,
+        'activities': df_activities,
+        'blocks': blocks,
+        'unassigned': df_activities[~assigned]
+    }
+
+@timed('get_calendar_blocks')
+def get_calendar_blocks(ath_id):
+    model = get_calendar_model(ath_id)
+
+    tags = [athlete_tag(ath_id)]
     results = []
-    for _, block in df_blocks.iterrows():
-        mask = (df_activities['date'] >= block['start_date']) & (df_activities['date'] <= block['end_date'])
-        block_activities = df_activities.loc[mask]
-        block_html = get_block_table(block_activities, block['start_date'])
+    for block in model['blocks']:
+        key = ('block_table', int(ath_id), block['block_id'], model['version'])
+        df_block = model['activities'].iloc[block['lo']:block['hi']]
+        block_html = fragment_cache.get_or_build(key, lambda: get_block_table(df_block, block['start_date']), tags)
         results.append({
             "name": block['name'],
             "period": f"{block['start_date'].date()} - {block['end_date'].date()}",
             "html": block_html,
             "block_id": block['block_id']
         })
-        df_unassigned = df_unassigned[~df_unassigned['activity_id'].isin(block_activities['activity_id'])]
-    
+
+    df_unassigned = model['unassigned']
     if not df_unassigned.empty:
-        df_unassigned.sort_values(by='date', ascending=False)
         others_start = df_unassigned['date'].min()
-        others_html = get_block_table(df_unassigned, others_start)
+        key = ('block_table', int(ath_id), -1, model['version'])
+        others_html = fragment_cache.get_or_build(key, lambda: get_block_table(df_unassigned, others_start), tags)
         results.append({
             "name": "Unassigned",
             "period": "---",
@@ -114,104 +161,57 @@ def get_calendar_blocks(ath_id):
     return results
 
 def get_activity_details(activity_id):
-    query_act = f"SELECT * FROM activities WHERE activity_id = {activity_id}"
-    query_laps = f"SELECT * FROM laps WHERE activity_id = {activity_id} ORDER BY lap_idx ASC"
-
-    act_info = pd.read_sql(query_act, engine)
-    laps_info = pd.read_sql(query_laps, engine)
-
-    if act_info.empty:
-        return "<p>Activity not found</p>"
-
-    act_info = format_distance(act_info)
-    laps_info = format_distance(laps_info)
-
-    if act_info['Session'].iloc[0]: laps_info = format_session_laps(laps_info)
-    
-    act_summary_cols = {
-        'name': 'Activity',
-        'type': 'Type',
-        'distance_km': 'Distance',
-        'pace': 'Avg Pace',
-        'time': 'Time',
-        'date': 'Date',
-        'training_load': 'Training Load'
-    }
-    laps_summary_cols = {
-        'name': 'Lap',
-        'distance_km': 'Distance (km)',
-        'time': 'Time',
-        'pace': 'Avg Pace',
-        'avg_hr': 'Avg HR'
-    }
-    act_summary = act_info[list(act_summary_cols.keys())].rename(columns=act_summary_cols).T
-    laps_summary = laps_info[list(laps_summary_cols.keys())].rename(columns=laps_summary_cols)
-    act_html = act_summary.to_html(header=False, classes='table activity-summary',escape=False)
-
-    if not laps_info.empty:
-        laps_html = laps_summary.to_html(index=False, classes='table laps-table', escape=False)
-    else:
-        laps_html = "<p>No laps info</p>"
-
-    return act_html, laps_html
+    activity = get_activity_row(activity_id)
+    if activity is None:
+        return None, None
 
-def format_distance(data):
-    data['distance_km'] = (data['distance'] / 1000).round(2)
-    return data
+    laps = get_lap_rows(activity_id)
+    if activity.session:
+        laps = format_session_laps(laps)
+    return activity, laps
 
-def quick_upload_dates():
-    today = date.today()
-    before = today + timedelta(days=1)
-
-    week_bef = today - timedelta(weeks=1) + timedelta(days=1)  
-    query = f"SELECT date FROM activities ORDER BY date DESC LIMIT 1"
-    latest = pd.read_sql(query, engine)
-    if not latest.empty:
-        latest = pd.to_datetime(latest['date'].iloc[0]).date()
-        after = max(week_bef,latest)
-    else:
-        after = week_bef
-    return after.strftime('%Y-%m-%d'), before.strftime('%Y-%m-%d')
-
-def format_session_laps(laps_data):
+def format_session_laps(laps):
     rep = 1
-    total_laps = len(laps_data)
-    
-    for i, row in laps_data.iterrows():
-        if row['lap_idx'] == 1:
-            laps_data.at[i, 'name'] = "Warm-Up"
-        elif row['lap_idx'] == total_laps:
-            laps_data.at[i, 'name'] = "Cooldown"
-        elif row['lap_idx'] % 2 == 0:
-            laps_data.at[i, 'name'] = f'<span class="rep">Rep {rep}</span>'
-            laps_data.at[i, 'distance_km'] = f'<span class="rep">{laps_data.at[i, 'distance_km']}</span>'
-            laps_data.at[i, 'time'] = f'<span class="rep">{laps_data.at[i, 'time']}</span>'
-            laps_data.at[i,'pace'] = f'<span rep="rep">{laps_data.at[i, 'pace']}</span>'
+    total_laps = len(laps)
+    result = []
+    for lap in laps:
+        if lap.lap_idx == 1:
+            lap = lap._replace(name="Warm-Up")
+        elif lap.lap_idx == total_laps:
+            lap = lap._replace(name="Cooldown")
+        elif lap.lap_idx % 2 == 0:
+            lap = lap._replace(name=f"Rep {rep}", is_rep=True)
             rep += 1
         else:
-            laps_data.at[i, 'name'] = "Rest"
-            
-    return laps_data
+            lap = lap._replace(name="Rest")
+        result.append(lap)
+    return result
 
 def get_chart_data(start, end, data_type, ath_id):
-    activities_query = get_period_activities(start, end, ath_id)
-    activities = pd.read_sql(activities_query.statement, engine)
+    import pandas as pd
     start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    #tygodnie ISO (pon-nd) z tabeli daily_rollups - te same przedziały co resample('W')
+    weekly_data = pd.read_sql(get_weekly_rollups(start.date(), end.date(), ath_id), engine)
     
-    if activities.empty:
+    if weekly_data.empty:
         return pd.DataFrame(columns=['date', data_type])
     
-    activities['date'] = pd.to_datetime(activities['date'])
+    weekly_data['date'] = pd.to_datetime([
+        date.fromisocalendar(int(year), int(week), 7) for year, week in zip(weekly_data['iso_year'], weekly_data['iso_week'])
+    ])
+    all_weeks = pd.date_range(weekly_data['date'].min(), weekly_data['date'].max(), freq='W-SUN', name='date')
+    weekly_data = weekly_data.set_index('date').reindex(all_weeks, fill_value=0).reset_index()
+
     if data_type == "distance_km":
-        activities = format_distance(activities)
-        weekly_data = activities.resample('W', on='date').agg(chart_data=('distance_km', 'sum')).reset_index()
+        weekly_data['chart_data'] = weekly_data['distance'] / 1000
         weekly_data['chart_hover'] = weekly_data['chart_data'].round(2).astype(str) + " km"
     elif data_type == "time":
-        weekly_data = activities.resample('W', on='date').agg(chart_data=('time_int', 'sum')).reset_index()
+        weekly_data['chart_data'] = weekly_data['time_int'].astype(int)
         weekly_data['chart_hover'] = weekly_data['chart_data'].apply(time_toString)
         weekly_data['chart_data'] = weekly_data['chart_data'] / 3600
     elif data_type =='training_load':
-        weekly_data = activities.resample('W', on='date').agg(chart_data=('training_load', 'sum')).reset_index()
+        weekly_data['chart_data'] = weekly_data['training_load'].astype(int)
         weekly_data['chart_hover'] = weekly_data['chart_data']
 
     weekly_data['week_num'] = ((weekly_data['date'] - start).dt.days // 7) + 1
@@ -219,51 +219,38 @@ def get_chart_data(start, end, data_type, ath_id):
 
     return weekly_data
 
-def generate_period_chart(start, end, data_type, ath_id):
-    df_weekly = get_chart_data(start, end, data_type, ath_id)
-    if df_weekly.empty:
-        return "<p class='text-muted text-center'>No data to display chart</p>"
-    
-    if data_type == "time":
-        y_label = 'Time (h)'
-        chart_title = "(Time)"
-        hover_label = "Time"
-    elif data_type == "distance_km":
-        y_label = 'Distance (km)'
-        chart_title = "(Distance)"
-        hover_label = "Distance"
-    elif data_type == "training_load":
-        y_label = "Training Load"
-        chart_title = "(Training Load)"
-        hover_label = "Training Load"
+#typ wykresu -> (opis osi Y, tytuł, etykieta w dymku)
+CHART_TYPES = {
+    'distance_km': ('Distance (km)', "(Distance)", "Distance"),
+    'time': ('Time (h)', "(Time)", "Time"),
+    'training_load': ("Training Load", "(Training Load)", "Training Load")
+}
 
-    y_max = df_weekly['chart_data'].max() * 1.2
-    y_min = df_weekly['chart_data'].min() * 0.8
+@timed('get_chart_series')
+def get_chart_series(start, end, data_type, ath_id):
+    #gotowy JSON dla wykresu rysowanego w przeglądarce, w cache do zmiany danych sportowca
+    if not ath_id:
+        return build_chart_series(start, end, data_type, ath_id)
+    key = ('chart_series', int(ath_id), str(start), str(end), data_type, get_data_version(ath_id))
+    return fragment_cache.get_or_build(key, lambda: build_chart_series(start, end, data_type, ath_id), [athlete_tag(ath_id)])
 
-    fig = px.area(
-        df_weekly, 
-        x='week_label', 
-        y='chart_data',
-        title=f'Weekly Training Volume {chart_title}',
-        labels={'chart_data': y_label, 'week_label': 'Week'},
-        template='plotly_white',
-        markers=True,
-        range_y=[y_min, y_max]
-    )
-
-    fig.update_traces(
-        customdata=df_weekly['chart_hover'],
-        line_color='#fc4c02',
-        line_width=3,
-        marker=dict(size=8, color='#e34402', symbol='circle'),
-        hovertemplate='<b>%{x}</b><br>' + hover_label + ': %{customdata}<extra></extra>'
-    )
+def build_chart_series(start, end, data_type, ath_id):
+    y_label, chart_title, hover_label = CHART_TYPES[data_type]
+    series = {
+        'title': f'Weekly Training Volume {chart_title}',
+        'y_label': y_label,
+        'hover_label': hover_label,
+        'labels': [],
+        'values': [],
+        'hover': [],
+        'y_range': None
+    }
 
-    fig.update_layout(
-        margin=dict(l=20, r=20, t=50, b=20),
-        height=350,
-        hovermode="x unified"
-    )
-    chart_html = pio.to_html(fig, full_html=False, include_plotlyjs='False', config={'responsive': True})
-    
-    return chart_html
\ No newline at end of file
+    df_weekly = get_chart_data(start, end, data_type, ath_id)
+    if not df_weekly.empty:
+        values = df_weekly['chart_data'].astype(float)
+        series['labels'] = df_weekly['week_label'].tolist()
+        series['values'] = values.round(4).tolist()
+        series['hover'] = df_weekly['chart_hover'].astype(str).tolist()
+        series['y_range'] = [values.min() * 0.8, values.max() * 1.2]
+    return json.dumps(series)
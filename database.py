@@ -0,0 +1,47 @@
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import sessionmaker
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///strava_data.db')
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+
+def create_db_engine(url=DATABASE_URL):
+    if url.startswith('sqlite'):
+        if ':memory:' in url or url in ('sqlite://', 'sqlite:///'):
+            #baza w pamięci istnieje tylko w jednym połączeniu - wszystkie wątki muszą dostać to samo
+            return create_engine(url, connect_args={'check_same_thread': False}, poolclass=StaticPool)
+
+        engine = create_engine(
+            url,
+            connect_args={'check_same_thread': False},
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW
+        )
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            #WAL - czytelnicy nie blokują zapisu, NORMAL wystarcza przy WAL
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=5000")
+            cursor.close()
+
+        return engine
+
+    return create_engine(
+        url,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_pre_ping=True,
+        pool_recycle=POOL_RECYCLE
+    )
+
+engine = create_db_engine()
+SessionLocal = sessionmaker(bind=engine)
@@ -1,49 +1,144 @@
-from sqlalchemy.orm import Session
-from models import init_db, Activity, Lap, Block, User
+from database import engine, SessionLocal
+from models import Activity, Lap, Block, User, SyncState, SyncJob, DataVersion, DailyRollup
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 import logging
-from sqlalchemy import select
+import threading
+import requests
+from typing import NamedTuple, Optional
+from sqlalchemy import select, insert, update, func
 from datetime import datetime, time
+import stream_store
+from fragment_cache import fragment_cache, athlete_tag
+from metrics import timed
 
-engine = init_db()
+#tokeny odświeżane z zapasem - ten sam margines co w ensure_access_token
+TOKEN_REFRESH_MARGIN = 60
+token_cache = {}
+token_locks = {}
+token_cache_lock = threading.Lock()
 
-def insert_activity_data(activities, laps_array, user_id):
-    session = Session(engine)
+class ActivityRow(NamedTuple):
+    activity_id: int
+    user_id: int
+    name: str
+    type: str
+    distance: float
+    time: str
+    pace: str
+    date: datetime
+    training_load: Optional[int]
+    session: bool
+
+    @property
+    def distance_km(self):
+        return round((self.distance or 0) / 1000, 2)
+
+class LapRow(NamedTuple):
+    lap_idx: int
+    name: str
+    distance: float
+    time: str
+    pace: str
+    avg_hr: Optional[int]
+    is_rep: bool = False
+
+    @property
+    def distance_km(self):
+        return round((self.distance or 0) / 1000, 2)
+
+CHUNK_SIZE = 500
+
+def chunked(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+@timed('insert_activity_data')
+def insert_activity_data(activities, laps_array, user_id, replace=False):
+    #replace=True nadpisuje już zapisane aktywności (tryb "refresh changed"), flaga Session
+    #i nazwa zmieniona lokalnie zostają
+    session = SessionLocal()
     try:
-        user = session.query(User).filter(User.user_id == user_id).first()
+        if session.get(User, user_id) is None:
+            return {'status': 'error', 'message': "User not found"}
+
+        ids = [activity['activity_id'] for activity in activities]
+        existing = set()
+        for chunk in chunked(ids):
+            existing.update(session.scalars(select(Activity.activity_id).where(Activity.activity_id.in_(chunk))))
+
+        activity_rows = []
+        updated_rows = []
+        lap_rows = []
+        seen = set()
         for activity, laps in zip(activities, laps_array):
-            exists = session.query(Activity).filter_by(activity_id=activity['activity_id']).first()
-            
-            if not exists:
-                new_activity = Activity(
-                    activity_id=activity['activity_id'],
-                    name=activity['name'],
-                    distance=activity['distance'],
-                    time=activity['time'],
-                    time_int=activity['time_int'],
-                    type=activity['type'],
-                    date=activity['date'],
-                    pace = activity['pace'],
-                    training_load = activity['training_load']
-                )
-                user.activities.append(new_activity)
-                #session.add(new_activity)
-
-                for i, lap in enumerate(laps, start=1):
-                    new_lap = Lap(
-                        lap_id = lap['lap_id'],
-                        name = lap['name'],
-                        distance = lap['distance'],
-                        time = lap['time'],
-                        time_int = lap['time_int'],
-                        lap_idx = i,
-                        pace = lap['pace'],
-                        avg_hr = lap['avg_hr']
-                    )
-                    new_activity.laps.append(new_lap)
+            if activity['activity_id'] in seen:
+                continue
+            seen.add(activity['activity_id'])
+            row = {
+                'activity_id': activity['activity_id'],
+                'name': activity['name'],
+                'strava_name': activity['name'],
+                'distance': activity['distance'],
+                'time': activity['time'],
+                'time_int': activity['time_int'],
+                'type': activity['type'],
+                'date': activity['date'],
+                'pace': activity['pace'],
+                'training_load': activity['training_load'],
+                'user_id': user_id
+            }
+            if activity['activity_id'] in existing:
+                if not replace:
+                    continue
+                updated_rows.append(row)
+            else:
+                activity_rows.append(row)
+            for i, lap in enumerate(laps, start=1):
+                lap_rows.append({
+                    'lap_id': lap['lap_id'],
+                    'activity_id': activity['activity_id'],
+                    'name': lap['name'],
+                    'distance': lap['distance'],
+                    'time': lap['time'],
+                    'time_int': lap['time_int'],
+                    'lap_idx': i,
+                    'pace': lap['pace'],
+                    'avg_hr': lap['avg_hr']
+                })
 
+        days = {row['date'].date() for row in activity_rows + updated_rows}
+        if updated_rows:
+            #stare okrążenia usuwane przed wstawieniem nowych, stare daty też trafiają do przeliczenia rollupów
+            updated_ids = [row['activity_id'] for row in updated_rows]
+            local_names = {}
+            for chunk in chunked(updated_ids):
+                stmt = select(Activity.activity_id, Activity.date, Activity.name, Activity.strava_name).where(Activity.activity_id.in_(chunk))
+                for activity_id, activity_date, name, strava_name in session.execute(stmt):
+                    days.add(activity_date.date())
+                    if name != strava_name:
+                        local_names[activity_id] = name
+                session.execute(Lap.__table__.delete().where(Lap.activity_id.in_(chunk)))
+            for row in updated_rows:
+                row['name'] = local_names.get(row['activity_id'], row['name'])
+            for chunk in chunked(updated_rows):
+                session.execute(update(Activity), chunk)
+
+        for chunk in chunked(activity_rows):
+            session.execute(insert(Activity), chunk)
+        for chunk in chunked(lap_rows):
+            session.execute(insert(Lap), chunk)
+
+        if days:
+            refresh_rollups(session, user_id, days)
+            bump_data_version(session, user_id)
         session.commit()
-        return {'status': 'success', 'message': "Completed", 'count': len(activities)}
+        return {
+            'status': 'success',
+            'message': "Completed",
+            'count': len(activity_rows),
+            'updated': len(updated_rows),
+            'skipped': len(activities) - len(activity_rows) - len(updated_rows)
+        }
 
     except IntegrityError as e:
         session.rollback()
@@ -61,28 +156,60 @@ def insert_activity_data(activities, laps_array, user_id):
         session.close()
 
 def delete(activity_id):
-    with Session(engine) as session:
+    with SessionLocal() as session:
         activity = session.query(Activity).filter_by(activity_id=activity_id).first()
         if activity:
+            bump_data_version(session, activity.user_id)
             session.delete(activity)
+            refresh_rollups(session, activity.user_id, {activity.date.date()})
             session.commit()
+            stream_store.delete_streams(activity_id)
 
 def rename(activity_id, new_name):
-    with Session(engine) as session:
+    with SessionLocal() as session:
             activity = session.query(Activity).filter_by(activity_id=activity_id).first()
             if activity:
                 activity.name = new_name
+                bump_data_version(session, activity.user_id)
                 session.commit()
 
 def change_session(activity_id):
-    with Session(engine) as session:
+    with SessionLocal() as session:
         activity = session.query(Activity).filter_by(activity_id=activity_id).first()
         if activity:
             activity.Session = not activity.Session
+            bump_data_version(session, activity.user_id)
             session.commit()
 
+def activity_row_query(activity_id):
+    return select(
+        Activity.activity_id, Activity.user_id, Activity.name, Activity.type, Activity.distance,
+        Activity.time, Activity.pace, Activity.date, Activity.training_load, Activity.Session
+    ).where(Activity.activity_id == activity_id)
+
+def get_activity_row(activity_id):
+    with engine.connect() as connection:
+        row = connection.execute(activity_row_query(activity_id)).first()
+    return ActivityRow(*row) if row else None
+
+def lap_rows_query(activity_id):
+    return select(
+        Lap.lap_idx, Lap.name, Lap.distance, Lap.time, Lap.pace, Lap.avg_hr
+    ).where(Lap.activity_id == activity_id).order_by(Lap.lap_idx)
+
+def get_lap_rows(activity_id):
+    with engine.connect() as connection:
+        return [LapRow(*row) for row in connection.execute(lap_rows_query(activity_id))]
+
+def latest_activity_date_query(ath_id):
+    return select(Activity.date).where(Activity.user_id == int(ath_id)).order_by(Activity.date.desc()).limit(1)
+
+def get_latest_activity_date(ath_id):
+    with engine.connect() as connection:
+        return connection.scalar(latest_activity_date_query(ath_id))
+
 def get_session(activity_id):
-    with Session(engine) as session:
+    with SessionLocal() as session:
         activity = session.query(Activity).filter_by(activity_id=activity_id).first()
         if activity:
             return activity.Session
@@ -96,7 +223,7 @@ def add_Block(name, start, end, user_id):
     start_dt = datetime.combine(start, time.min)
     end_dt = datetime.combine(end, time.max)
 
-    session = Session(engine)
+    session = SessionLocal()
     try:
         user = session.query(User).filter(User.user_id == user_id).first()
         new_block = Block(
@@ -105,6 +232,7 @@ def add_Block(name, start, end, user_id):
             end_date=end_dt
         )
         user.blocks.append(new_block)
+        bump_data_version(session, user.user_id)
         session.commit()
     except Exception as e:
         session.rollback()
@@ -114,22 +242,100 @@ def add_Block(name, start, end, user_id):
         session.close()
 
 def delete_block(block_id):    
-    with Session(engine) as session:
+    with SessionLocal() as session:
         block = session.query(Block).filter_by(block_id=block_id).first()
         if block:
+            bump_data_version(session, block.user_id)
             session.delete(block)
             session.commit()
             return True
         else: 
             return False
         
+def bump_data_version(session, ath_id):
+    #wywoływane w tej samej transakcji co zmiana danych, więc widzą to wszystkie procesy
+    ath_id = int(ath_id)
+    result = session.execute(
+        update(DataVersion).where(DataVersion.user_id == ath_id).values(version=DataVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        session.add(DataVersion(user_id=ath_id, version=1))
+    fragment_cache.invalidate(athlete_tag(ath_id))
+
+def get_data_version(ath_id):
+    with SessionLocal() as session:
+        version = session.scalar(select(DataVersion.version).where(DataVersion.user_id == int(ath_id)))
+        return version or 0
+
+def refresh_rollups(session, ath_id, days):
+    #przelicza wiersze daily_rollups tylko dla podanych dni, w bieżącej transakcji
+    days = sorted(set(days))
+    if not days:
+        return
+    ath_id = int(ath_id)
+    wanted = set(days)
+
+    rows = session.execute(
+        select(Activity.date, Activity.distance, Activity.time_int, Activity.training_load).where(
+            Activity.user_id == ath_id,
+            Activity.date >= datetime.combine(days[0], time.min),
+            Activity.date <= datetime.combine(days[-1], time.max)
+        )
+    )
+    totals = {}
+    for date, distance, time_int, training_load in rows:
+        day = date.date()
+        if day not in wanted:
+            continue
+        total = totals.setdefault(day, {'distance': 0, 'time_int': 0, 'training_load': 0, 'activity_count': 0})
+        total['distance'] += distance or 0
+        total['time_int'] += time_int or 0
+        total['training_load'] += training_load or 0
+        total['activity_count'] += 1
+
+    for chunk in chunked(days):
+        session.query(DailyRollup).filter(DailyRollup.user_id == ath_id, DailyRollup.day.in_(chunk)).delete(synchronize_session=False)
+
+    rollup_rows = []
+    for day, total in totals.items():
+        iso_year, iso_week, _ = day.isocalendar()
+        rollup_rows.append({'user_id': ath_id, 'day': day, 'iso_year': iso_year, 'iso_week': iso_week, **total})
+    for chunk in chunked(rollup_rows):
+        session.execute(insert(DailyRollup), chunk)
+
+def rebuild_rollups():
+    #jednorazowe wypełnienie tabeli dla baz sprzed wprowadzenia rollupów
+    with SessionLocal() as session:
+        if session.scalar(select(func.count()).select_from(DailyRollup)):
+            return
+        for ath_id in session.scalars(select(Activity.user_id).distinct()):
+            if ath_id is None:
+                continue
+            days = {date.date() for date in session.scalars(select(Activity.date).where(Activity.user_id == ath_id))}
+            refresh_rollups(session, ath_id, days)
+        session.commit()
+
+def get_weekly_rollups(start, end, ath_id):
+    return select(
+        DailyRollup.iso_year,
+        DailyRollup.iso_week,
+        func.sum(DailyRollup.distance).label('distance'),
+        func.sum(DailyRollup.time_int).label('time_int'),
+        func.sum(DailyRollup.training_load).label('training_load'),
+        func.sum(DailyRollup.activity_count).label('activity_count')
+    ).where(
+        DailyRollup.user_id == ath_id,
+        DailyRollup.day >= start,
+        DailyRollup.day <= end
+    ).group_by(DailyRollup.iso_year, DailyRollup.iso_week).order_by(DailyRollup.iso_year, DailyRollup.iso_week)
+
 def get_period_activities(start, end, ath_id):
-    with Session(engine) as session:
+    with SessionLocal() as session:
         activities = session.query(Activity).filter(Activity.date >= start, Activity.date <= end, Activity.user_id == ath_id)
         return activities
     
 def get_block_period(block_id):
-    with Session(engine) as session:
+    with SessionLocal() as session:
         block = session.query(Block).filter_by(block_id=block_id).first()
         if block:
             return block.start_date, block.end_date
@@ -137,7 +343,7 @@ def get_block_period(block_id):
     
 def get_block_object(block_id: int):
     block_id = int(block_id)
-    with Session(engine) as session:
+    with SessionLocal() as session:
         if block_id > 0:
             block = session.query(Block).filter_by(block_id=block_id).first()
             if block:
@@ -145,7 +351,7 @@ def get_block_object(block_id: int):
         return None
 
 def insert_user(data):
-    session = Session(engine)
+    session = SessionLocal()
     try:
         user = session.query(User).filter(User.user_id == data['athlete_id']).first()
         if user:
@@ -168,6 +374,35 @@ def insert_user(data):
     finally:
         session.close()
 
+def get_activity_summaries(activity_ids):
+    #activity_id -> (nazwa ze Stravy, distance, time_int) dla już zapisanych aktywności z listy,
+    #dla aktywności zapisanych przed kolumną strava_name - bieżąca nazwa
+    summaries = {}
+    stmt = select(Activity.activity_id, func.coalesce(Activity.strava_name, Activity.name), Activity.distance, Activity.time_int)
+    with engine.connect() as connection:
+        for chunk in chunked(list(activity_ids)):
+            for activity_id, name, distance, time_int in connection.execute(stmt.where(Activity.activity_id.in_(chunk))):
+                summaries[activity_id] = (name, distance, time_int)
+    return summaries
+
+def get_user_activity_ids(ath_id):
+    with SessionLocal() as session:
+        return list(session.scalars(select(Activity.activity_id).where(Activity.user_id == int(ath_id)).order_by(Activity.date)))
+
+def update_training_loads(rows, ath_id):
+    #rows: [{'activity_id': ..., 'training_load': ...}] - UPDATE po kluczu głównym w paczkach
+    if not rows:
+        return
+    with SessionLocal() as session:
+        days = set()
+        for chunk in chunked(rows):
+            session.execute(update(Activity), chunk)
+            ids = [row['activity_id'] for row in chunk]
+            days.update(date.date() for date in session.scalars(select(Activity.date).where(Activity.activity_id.in_(ids))))
+        refresh_rollups(session, ath_id, days)
+        bump_data_version(session, ath_id)
+        session.commit()
+
 def get_user_activities(ath_id):
     return select(Activity).where(Activity.user_id == ath_id)
     
@@ -175,42 +410,204 @@ def get_user_blocks(ath_id):
     return select(Block).where(Block.user_id == ath_id)
 
 def get_access_token(ath_id):
+    #token z pamięci, dopóki nie wygasa - odświeżanie tylko przez jeden wątek na sportowca,
+    #pozostałe czekają na locku i dostają już odświeżony token
+    ath_id = int(ath_id)
+    token = get_cached_token(ath_id)
+    if token is not None:
+        return token
+
+    with token_lock(ath_id):
+        token = get_cached_token(ath_id)
+        if token is not None:
+            return token
+        try:
+            return refresh_access_token(ath_id)
+        except SQLAlchemyError as e:
+            logging.error(f"Database error while refreshing token for {ath_id}: {e}")
+            return None
+        except requests.RequestException as e:
+            logging.error(f"Strava token refresh failed for {ath_id}: {e}")
+            return None
+
+def refresh_access_token(ath_id):
     from strava_services import ensure_access_token
-    session = Session(engine)
-    try:
-        user = session.query(User).filter(User.user_id == ath_id).first()
-        if user:
+    user_data = read_user_token(ath_id)
+    if user_data is None:
+        return None
+    if not token_expiring(user_data['expires_at']):
+        #inny worker już odświeżył token i zapisał go w bazie
+        cache_token(ath_id, user_data)
+        return user_data['access_token']
 
-            user_data = {
-            'access_token': user.access_token,
-            'refresh_token': user.refresh_token,
-            'expires_at': user.expires_at
-            }
-            user_data = ensure_access_token(user_data)
+    new_data = ensure_access_token(dict(user_data))
+    if new_data is None:
+        return None
+
+    #compare-and-swap: zapis tylko jeśli w bazie jest wciąż token, który odświeżaliśmy
+    with SessionLocal() as session:
+        result = session.execute(
+            update(User)
+            .where(
+                User.user_id == ath_id,
+                User.refresh_token == user_data['refresh_token'],
+                User.expires_at == user_data['expires_at']
+            )
+            .values(
+                access_token=new_data['access_token'],
+                refresh_token=new_data['refresh_token'],
+                expires_at=new_data['expires_at']
+            )
+        )
+        session.commit()
+
+    if result.rowcount == 0:
+        #wyścig przegrany z innym workerem - jego token jest w bazie
+        user_data = read_user_token(ath_id)
+        if user_data is None or token_expiring(user_data['expires_at']):
+            return None
+        new_data = user_data
+    cache_token(ath_id, new_data)
+    return new_data['access_token']
+
+def read_user_token(ath_id):
+    with engine.connect() as connection:
+        row = connection.execute(
+            select(User.access_token, User.refresh_token, User.expires_at).where(User.user_id == ath_id)
+        ).first()
+    return dict(row._mapping) if row else None
+
+def token_expiring(expires_at):
+    return expires_at is None or expires_at < datetime.now().timestamp() + TOKEN_REFRESH_MARGIN
 
-            user.access_token = user_data['access_token']
-            user.refresh_token = user_data['refresh_token']
-            user.expires_at = user_data['expires_at']
+def get_cached_token(ath_id):
+    with token_cache_lock:
+        cached = token_cache.get(ath_id)
+    if cached is None or token_expiring(cached['expires_at']):
+        return None
+    return cached['access_token']
+
+def cache_token(ath_id, user_data):
+    with token_cache_lock:
+        token_cache[ath_id] = {'access_token': user_data['access_token'], 'expires_at': user_data['expires_at']}
+
+def token_lock(ath_id):
+    with token_cache_lock:
+        return token_locks.setdefault(ath_id, threading.Lock())
+
+def get_backfill_checkpoint(ath_id):
+    #(checkpoint, start, end) niedokończonego importu historii albo None
+    with SessionLocal() as session:
+        state = session.get(SyncState, int(ath_id))
+        if state and state.backfill_after is not None:
+            return state.backfill_after, state.backfill_start or 0, state.backfill_end
+        return None
 
+def set_backfill_checkpoint(ath_id, timestamp, start=0, end=None):
+    with SessionLocal() as session:
+        state = session.get(SyncState, int(ath_id))
+        if state is None:
+            state = SyncState(user_id=int(ath_id))
+            session.add(state)
+        state.backfill_after = timestamp
+        state.backfill_start = start
+        state.backfill_end = end
+        session.commit()
+
+def clear_backfill_checkpoint(ath_id):
+    with SessionLocal() as session:
+        state = session.get(SyncState, int(ath_id))
+        if state is not None:
+            state.backfill_after = None
+            state.backfill_start = None
+            state.backfill_end = None
             session.commit()
 
-            return user.access_token
-        else:
-            return None
-    except Exception as e:
-        session.rollback()
-        logging.error(f"Database error: {e}")
+def get_sync_cursor(ath_id):
+    with SessionLocal() as session:
+        state = session.get(SyncState, int(ath_id))
+        if state:
+            return state.last_synced_at
         return None
-    finally:
-        session.close()
+
+def set_sync_cursor(ath_id, timestamp):
+    with SessionLocal() as session:
+        state = session.get(SyncState, int(ath_id))
+        if state is None:
+            state = SyncState(user_id=int(ath_id))
+            session.add(state)
+        state.last_synced_at = timestamp
+        session.commit()
+
+def claim_job(record, stale_after):
+    #zapis nowego zadania - unikalny active_key przepuszcza tylko jedno aktywne zadanie danego
+    #rodzaju na sportowca we wszystkich workerach; zwraca None albo rekord zadania, które już trwa
+    for _ in range(2):
+        with SessionLocal() as session:
+            try:
+                session.add(SyncJob(**record))
+                session.commit()
+                return None
+            except IntegrityError:
+                session.rollback()
+            active = session.scalars(select(SyncJob).where(SyncJob.active_key == record['active_key'])).first()
+            if active is None:
+                continue
+            if active.updated_at >= record['created_at'] - stale_after:
+                return job_record(active)
+            #worker, który prowadził zadanie, przestał je odświeżać - zadanie uznajemy za porzucone
+            logging.warning(f"Releasing abandoned job {active.job_id}")
+            active.status = 'error'
+            active.message = "The job was interrupted."
+            active.active_key = None
+            active.finished_at = record['created_at']
+            session.commit()
+    raise RuntimeError(f"Cannot register job {record['job_id']}")
+
+def update_job(job_id, **values):
+    try:
+        with SessionLocal() as session:
+            session.execute(update(SyncJob).where(SyncJob.job_id == job_id).values(**values))
+            session.commit()
+    except SQLAlchemyError as e:
+        logging.error(f"Cannot save state of job {job_id}: {e}")
+
+def get_job_record(job_id):
+    with SessionLocal() as session:
+        job = session.get(SyncJob, job_id)
+        return job_record(job) if job else None
+
+def latest_job_query(ath_id, kind):
+    return select(SyncJob).where(SyncJob.user_id == int(ath_id), SyncJob.kind == kind).order_by(SyncJob.created_at.desc()).limit(1)
+
+def get_latest_job_record(ath_id, kind):
+    with SessionLocal() as session:
+        job = session.scalars(latest_job_query(ath_id, kind)).first()
+        return job_record(job) if job else None
+
+def delete_finished_jobs(before):
+    with SessionLocal() as session:
+        session.execute(SyncJob.__table__.delete().where(SyncJob.active_key.is_(None), SyncJob.finished_at < before))
+        session.commit()
+
+def job_record(job):
+    return {column.name: getattr(job, column.name) for column in SyncJob.__table__.columns}
 
 def get_user_data(user_id):
-    with Session(engine) as session:
+    with SessionLocal() as session:
         user = session.query(User).filter(User.user_id == user_id).first()
         return user.to_dict()
     
+def get_zone_settings(ath_id):
+    #progi stref tętna - czytane raz na synchronizację lub paczkę przeliczania i przekazywane dalej
+    with SessionLocal() as session:
+        row = session.execute(
+            select(User.z1_limit, User.z2_limit, User.z3_limit, User.z4_limit, User.hr_max).where(User.user_id == int(ath_id))
+        ).first()
+    return dict(row._mapping) if row else None
+
 def update_HRzones(user_id, update_data):
-    session = Session(engine)
+    session = SessionLocal()
     try:
         user = session.query(User).filter(User.user_id == user_id).first()
         user.z1_limit = update_data['z1']
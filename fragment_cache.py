@@ -0,0 +1,109 @@
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MAX_BYTES = int(os.getenv('FRAGMENT_CACHE_BYTES', 32 * 1024 * 1024))
+
+#LRU ograniczony łącznym rozmiarem - fragmenty HTML i modele kalendarza
+#klucze zawierają wersję danych sportowca, a tag ('athlete', id) pozwala od razu zwolnić jego wpisy
+class FragmentCache:
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, tags=()):
+        size = fragment_size(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, tuple(tags))
+            self.size += size
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def get_or_build(self, key, build, tags=()):
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.put(key, value, tags)
+        return value
+
+    def invalidate(self, tag):
+        with self.lock:
+            for key in self.tags.pop(tag, set()):
+                if key in self.entries:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'size_bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+    def _remove(self, key):
+        value, size, tags = self.entries.pop(key)
+        self.size -= size
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+def fragment_size(value):
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(fragment_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(fragment_size(item) for item in value.values())
+    if hasattr(value, 'memory_usage'):
+        #DataFrame pandas - bez importu pandas w tym module
+        return int(value.memory_usage(deep=True).sum())
+    return 64
+
+def athlete_tag(ath_id):
+    return ('athlete', int(ath_id))
+
+fragment_cache = FragmentCache()
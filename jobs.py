@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from db_logic import claim_job, update_job, get_job_record, get_latest_job_record, delete_finished_jobs
+
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+MAX_FINISHED_JOBS = 200
+#postęp zapisywany w bazie co HEARTBEAT_INTERVAL s - zadanie bez zapisu przez STALE_AFTER s uznajemy za porzucone
+HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', 2))
+STALE_AFTER = float(os.getenv('JOB_STALE_AFTER', 120))
+KEEP_FINISHED = 24 * 3600
+
+class Job:
+    def __init__(self, kind, ath_id, label=None):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.label = label or kind
+        self.ath_id = ath_id
+        self.status = 'queued'
+        self.message = None
+        self.progress = {}
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @classmethod
+    def from_record(cls, record):
+        job = cls(record['kind'], record['user_id'], record['label'])
+        job.job_id = record['job_id']
+        job.status = record['status']
+        job.message = record['message']
+        job.progress = json.loads(record['progress'] or '{}')
+        job.created_at = record['created_at']
+        job.finished_at = record['finished_at']
+        return job
+
+    @property
+    def finished(self):
+        return self.status in ('success', 'error')
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'label': self.label,
+            'status': self.status,
+            'message': self.message,
+            'progress': dict(self.progress),
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+#długie zadania (synchronizacje, przeliczanie TL) w puli wątków, poza żądaniem HTTP;
+#jedno aktywne zadanie danego rodzaju na sportowca - kolejne submit zwraca już trwające,
+#stan w tabeli sync_jobs, więc postęp i blokada działają między workerami uvicorna
+class JobManager:
+    def __init__(self, max_workers=JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = {}
+        self.active = {}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat = None
+
+    def submit(self, kind, ath_id, fn, *args, label=None):
+        #fn(*args, progress=job.progress) zwraca {'status', 'message'}; label - co zlecono (upload, backfill...),
+        #wywołujący porównuje go z etykietą zwróconego zadania, żeby pokazać, że trwa inne
+        with self.lock:
+            active_id = self.active.get((kind, ath_id))
+            if active_id is not None:
+                return self.jobs[active_id]
+
+            job = Job(kind, ath_id, label)
+            running = claim_job(self._record(job), STALE_AFTER)
+            if running is not None:
+                #zadanie prowadzi inny worker
+                return Job.from_record(running)
+            self.jobs[job.job_id] = job
+            self.active[(kind, ath_id)] = job.job_id
+            self._trim()
+            self._start_heartbeat()
+        self.executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+        record = get_job_record(job_id)
+        return Job.from_record(record) if record else None
+
+    def latest(self, kind, ath_id):
+        #ostatnie zadanie danego rodzaju, także uruchomione przez inny worker
+        record = get_latest_job_record(ath_id, kind)
+        if record is None:
+            return None
+        with self.lock:
+            job = self.jobs.get(record['job_id'])
+        return job if job is not None else Job.from_record(record)
+
+    def shutdown(self):
+        self.stopped.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            queued = [job for job in self.jobs.values() if job.status == 'queued']
+        for job in queued:
+            job.status = 'error'
+            job.message = "The server stopped before the job started."
+            job.finished_at = time.time()
+            self._save(job)
+
+    def _run(self, job, fn, args):
+        job.status = 'running'
+        self._save(job)
+        try:
+            result = fn(*args, progress=job.progress)
+            job.status = 'success' if result['status'] == 'success' else 'error'
+            job.message = result.get('message')
+        except Exception as e:
+            logging.error(f"Job {job.kind} for {job.ath_id} failed: {e}")
+            job.status = 'error'
+            job.message = str(e)
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+            with self.lock:
+                self.active.pop((job.kind, job.ath_id), None)
+
+    def _record(self, job):
+        return {
+            'job_id': job.job_id,
+            'user_id': job.ath_id,
+            'kind': job.kind,
+            'label': job.label,
+            'status': job.status,
+            'message': job.message,
+            'progress': json.dumps(dict(job.progress)),
+            'active_key': None if job.finished else f"{job.kind}:{job.ath_id}",
+            'created_at': job.created_at,
+            'updated_at': time.time(),
+            'finished_at': job.finished_at
+        }
+
+    def _save(self, job, heartbeat=False):
+        #jeden zapis naraz - spóźnione odświeżenie nie nadpisze stanu zakończonego zadania
+        with self.save_lock:
+            if heartbeat and job.finished:
+                return
+            record = self._record(job)
+            del record['job_id'], record['created_at']
+            update_job(job.job_id, **record)
+
+    def _start_heartbeat(self):
+        if self.heartbeat is None:
+            self.heartbeat = threading.Thread(target=self._beat, name="job-heartbeat", daemon=True)
+            self.heartbeat.start()
+
+    def _beat(self):
+        #odświeża postęp i updated_at zadań prowadzonych przez ten proces
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            with self.lock:
+                unfinished = [job for job in self.jobs.values() if not job.finished]
+            for job in unfinished:
+                self._save(job, heartbeat=True)
+
+    def _trim(self):
+        #stare zakończone zadania są usuwane, żeby słownik nie rósł bez końca
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job.job_id]
+        delete_finished_jobs(time.time() - KEEP_FINISHED)
+
+jobs = JobManager()
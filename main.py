@@ -1,18 +1,41 @@
 from fastapi import FastAPI
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, PlainTextResponse
 from fastapi import Form
-from fastapi import Request
+from fastapi import Request, Response
+from contextlib import asynccontextmanager
 import strava_services as s
+import strava_client
+import metrics
+import profiling
+from profiling import profiled
+from jobs import jobs
+from fragment_cache import fragment_cache
+from migrations import migrate
+from database import engine
 from datetime import datetime
-from db_logic import insert_activity_data, delete, rename, change_session, get_session, add_Block, delete_block, get_block_period, get_block_object, get_access_token, get_user_data, update_HRzones
-from data_analysis import get_calendar_blocks, get_activity_details, quick_upload_dates, generate_period_chart
-from services import auto_calculate_zones
+from db_logic import rebuild_rollups, delete, rename, change_session, add_Block, delete_block, get_block_object, get_user_data, update_HRzones, get_data_version
+from data_analysis import get_calendar_blocks, get_activity_details, get_chart_series, CHART_TYPES
+from services import auto_calculate_zones, recompute_training_load
 
 templates = Jinja2Templates(directory="templates")
 
-app = FastAPI(title="Strava Analytics App")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    migrate(engine)
+    rebuild_rollups()
+    yield
+    jobs.shutdown()
+    strava_client.close()
+
+app = FastAPI(title="Strava Analytics App", lifespan=lifespan)
+
+if metrics.METRICS_ENABLED:
+    metrics.instrument_engine(engine)
+    app.middleware("http")(metrics.record_request)
+if profiling.PROFILING_ENABLED:
+    app.middleware("http")(profiling.select_request)
 
 @app.get("/")
 async def root(request: Request):
@@ -32,43 +55,43 @@ async def callback(code: str):
     return s.callback_func(code)
 
 @app.get("/upload_activities")
-def upload_actvities(request: Request, start_date, end_date):
+def upload_actvities(request: Request, start_date, end_date, refresh: bool = False):
     ath_id = request.cookies.get("athlete_id")
     if not ath_id:
         return RedirectResponse(url="/login")
-    token = get_access_token(int(ath_id))
-    result = s.get_activities(start_date, end_date, token, request.cookies.get("athlete_id"))
+    job = jobs.submit('sync', int(ath_id), s.sync_activities, int(ath_id), start_date, end_date, refresh, label='upload')
+    return templates.TemplateResponse(
+        request=request,
+        name="job.html",
+        context={"job": job, "busy": job.label != 'upload'}
+    )
 
-    if result == None:
-        return templates.TemplateResponse(
-            request=request, 
-            name="message.html", 
-            context={"status": "error", "message": "No activities were uploaded"}
-        )
+@app.get("/backfill", response_class=HTMLResponse)
+def backfill(request: Request, start_date: str = None, end_date: str = None):
+    ath_id = request.cookies.get("athlete_id")
+    if not ath_id:
+        return RedirectResponse(url="/login")
+    job = jobs.submit('sync', int(ath_id), s.sync_history, int(ath_id), start_date or None, end_date or None, label='backfill')
+    return templates.TemplateResponse(
+        request=request,
+        name="job.html",
+        context={"job": job, "busy": job.label != 'backfill'}
+    )
 
-    activities_data, laps_data = result
-    if activities_data != None:
-        result = insert_activity_data(activities_data, laps_data, int(request.cookies.get("athlete_id")))
-        if result['status'] == 'success':
-            return templates.TemplateResponse(
-            request=request, 
-            name="message.html", 
-            context={"status": "success", "message": f"Successfully update {result['count']} activities."}
-        )
-        else:
-            return templates.TemplateResponse(
-            request=request, 
-            name="message.html", 
-            context={"status": "error", "message": "Failed to upload activities due to a database error."}
-        )
-    else:
-        return templates.TemplateResponse(
-            request=request, 
-            name="message.html", 
-            context={"status": "error", "message": "Failed to upload activities due to a request error."}
-        )
+@app.get("/jobs/{job_id}", response_class=HTMLResponse)
+def get_job_status(request: Request, job_id: str):
+    job = jobs.get(job_id)
+    ath_id = request.cookies.get("athlete_id")
+    if job is None or not ath_id or job.ath_id != int(ath_id):
+        return HTMLResponse("<p class='text-muted'>Job not found.</p>", status_code=404)
+    return templates.TemplateResponse(
+        request=request,
+        name="partials/job_status.html",
+        context={"job": job}
+    )
 
 @app.get("/calendar", response_class=HTMLResponse)
+@profiled
 def calendar(request: Request):
     if request.cookies.get("athlete_id"):
         blocks_tables = get_calendar_blocks(request.cookies.get("athlete_id"))
@@ -81,10 +104,11 @@ def calendar(request: Request):
         return RedirectResponse(url="/login", status_code=303)
 
 @app.get("/show_details", response_class=HTMLResponse)
+@profiled
 def get_details(request: Request, activity_id: int):
-    act_html, laps_html =  get_activity_details(activity_id)
+    activity, laps = get_activity_details(activity_id)
 
-    if act_html is None:
+    if activity is None:
         return templates.TemplateResponse(
             request=request, 
             name="message.html", 
@@ -94,17 +118,24 @@ def get_details(request: Request, activity_id: int):
         request=request,
         name="details.html",
         context={
-            "act_html": act_html,
-            "laps_html": laps_html,
+            "activity": activity,
+            "laps": laps,
             "activity_id": activity_id,
-            "session": get_session(activity_id)
+            "session": activity.session
         }
     )
 
 @app.get("/upload_latest", response_class=HTMLResponse)
 def upload_latest(request: Request):
-    after, before = quick_upload_dates()
-    return upload_actvities(request, after, before)
+    ath_id = request.cookies.get("athlete_id")
+    if not ath_id:
+        return RedirectResponse(url="/login")
+    job = jobs.submit('sync', int(ath_id), s.sync_latest, int(ath_id), label='latest')
+    return templates.TemplateResponse(
+        request=request,
+        name="job.html",
+        context={"job": job, "busy": job.label != 'latest'}
+    )
 
 @app.get("/manual_upload", response_class=HTMLResponse)
 def show_sync_form(request: Request):
@@ -183,15 +214,14 @@ def delete_tblock(request: Request, block_id: int):
         )
     
 @app.get("/block_details/{block_id}/{data_type}", response_class=HTMLResponse)
+@profiled
 def show_block_summary(request: Request, block_id, data_type):
-    start, end = get_block_period(block_id)
     block = get_block_object(block_id)
-    chart = generate_period_chart(start, end, data_type, request.cookies.get("athlete_id"))
     if block != None:
         return templates.TemplateResponse(
             request=request,
             name="block.html",
-            context={"chart": chart, "block": block}
+            context={"block": block, "data_type": data_type if data_type in CHART_TYPES else 'distance_km'}
         )
     else:
         return templates.TemplateResponse(
@@ -199,16 +229,27 @@ def show_block_summary(request: Request, block_id, data_type):
             name="message.html",
             context={"status": "danger", "message": "Cannot show details for this block"}
         )
-    
-@app.get('/get_chart/{block_id}', response_class=HTMLResponse)
-async def get_chart_only(request: Request, block_id: int, type: str = 'distance_km'):
+
+@app.get('/chart_data/{block_id}')
+@profiled
+def get_chart_data_json(request: Request, block_id: int, type: str = 'distance_km'):
+    ath_id = request.cookies.get("athlete_id")
+    if not ath_id:
+        return Response(status_code=401)
+    if type not in CHART_TYPES:
+        return Response(status_code=400)
     block = get_block_object(block_id)
-    
-    if not block:
-        return "<p>Block not found</p>"
-    chart_html = generate_period_chart(block.start_date, block.end_date, type, request.cookies.get("athlete_id"))
-    
-    return chart_html
+    if block is None or block.user_id != int(ath_id):
+        return Response(status_code=404)
+
+    #każda zmiana danych sportowca (także bloków) podbija wersję, więc ETag się zmienia
+    etag = f'"{block_id}-{type}-{get_data_version(ath_id)}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    series = get_chart_series(block.start_date, block.end_date, type, ath_id)
+    return Response(content=series, media_type="application/json", headers=headers)
 
 @app.get('/settings', response_class=HTMLResponse)
 def show_settings_view(request: Request):
@@ -243,6 +284,14 @@ def get_hr_form(request: Request):
         context={'user': get_user_data(request.cookies.get("athlete_id"))}
     )
 
+@app.get('/settings/recompute_status', response_class=HTMLResponse)
+def get_recompute_status(request: Request):
+    return templates.TemplateResponse(
+        request=request,
+        name="partials/recompute_status.html",
+        context={'job': jobs.latest('recompute', int(request.cookies.get("athlete_id")))}
+    )
+
 @app.post('/settings/update', response_class=HTMLResponse)
 def update_zones(
         request: Request,
@@ -262,6 +311,9 @@ def update_zones(
     }
 
     if(update_HRzones(request.cookies.get("athlete_id"), update_data)):
+        #zadanie już trwające samo zauważy nowe strefy i zacznie od nowa
+        ath_id = int(request.cookies.get("athlete_id"))
+        jobs.submit('recompute', ath_id, recompute_training_load, ath_id)
         return templates.TemplateResponse(
             request=request,
             name="partials/HRzones_view.html",
@@ -277,5 +329,42 @@ def update_zones(
 @app.post('/autozones', response_class=HTMLResponse)
 def set_autozones(request: Request, max_HR: int = Form(...), rest_HR: int = Form(...)):
     new_hr_data = auto_calculate_zones(max_HR, rest_HR)
-    update_HRzones(request.cookies.get("athlete_id"), new_hr_data)
-    return RedirectResponse(url=f"/settings", status_code=303)
\ No newline at end of file
+    if update_HRzones(request.cookies.get("athlete_id"), new_hr_data):
+        ath_id = int(request.cookies.get("athlete_id"))
+        jobs.submit('recompute', ath_id, recompute_training_load, ath_id)
+    return RedirectResponse(url=f"/settings", status_code=303)
+
+@app.get('/cache_stats')
+def get_cache_stats():
+    return fragment_cache.stats()
+
+@app.get('/metrics')
+def get_metrics():
+    if not metrics.METRICS_ENABLED:
+        return PlainTextResponse("Metrics are disabled, set METRICS_ENABLED=1.", status_code=404)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get('/profiles', response_class=HTMLResponse)
+def get_profiles(request: Request, limit: int = 20):
+    if not profiling.PROFILING_ENABLED:
+        return PlainTextResponse("Profiling is disabled, set PROFILING_ENABLED=1.", status_code=404)
+    if not profiling.authorized(request):
+        return PlainTextResponse("Profiles require a valid PROFILE_TOKEN.", status_code=403)
+    return templates.TemplateResponse(
+        request=request,
+        name="profiles.html",
+        context={"profiles": profiling.list_profiles(limit), "token": request.query_params.get('token')}
+    )
+
+@app.get('/profiles/{name}')
+def get_profile_report(request: Request, name: str, sort: str = 'cumulative'):
+    if not profiling.PROFILING_ENABLED:
+        return PlainTextResponse("Profiling is disabled, set PROFILING_ENABLED=1.", status_code=404)
+    if not profiling.authorized(request):
+        return PlainTextResponse("Profiles require a valid PROFILE_TOKEN.", status_code=403)
+    if sort not in ('cumulative', 'tottime', 'calls'):
+        sort = 'cumulative'
+    report = profiling.profile_report(name, sort)
+    if report is None:
+        return PlainTextResponse("Profile not found.", status_code=404)
+    return PlainTextResponse(report)
\ No newline at end of file
@@ -0,0 +1,184 @@
+import os
+import time
+import functools
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext, contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+load_dotenv()
+
+#wyłączone metryki nie dodają middleware ani listenera SQLAlchemy, a @timed zwraca funkcję bez zmian
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0').lower() in ('1', 'true', 'yes')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+#liczniki bieżącego żądania HTTP - ustawiane przez middleware, None poza żądaniem
+request_counts = ContextVar('request_counts', default=None)
+
+registry = []
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def label_values(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def format_labels(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (f'{name}="{escape_label(value)}"' for name, value in pairs)
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted(self.values.items())
+            lines.extend(self.render_samples(items))
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render_samples(self, items):
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in items]
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                #[liczniki kubełków, suma, liczba obserwacji]
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render_samples(self, items):
+        lines = []
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', format_bound(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {count}")
+        return lines
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    #wartości odczytywane dopiero przy renderowaniu - collect zwraca {(wartości etykiet): wartość}
+    def __init__(self, name, documentation, collect, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def render_samples(self, items):
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in sorted(self.collect().items())]
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_bound(bound):
+    return repr(float(bound))
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', "HTTP request latency", ('method', 'route', 'status'))
+REQUEST_STRAVA_CALLS = Histogram('http_request_strava_calls', "Strava API calls made while serving a request", ('route',), COUNT_BUCKETS)
+REQUEST_DB_QUERIES = Histogram('http_request_db_queries', "Database queries made while serving a request", ('route',), COUNT_BUCKETS)
+SPAN_SECONDS = Histogram('span_duration_seconds', "Time spent in instrumented hot paths", ('span',))
+STRAVA_SECONDS = Histogram('strava_request_duration_seconds', "Strava API call latency", ('status',))
+STRAVA_CALLS = Counter('strava_requests_total', "Strava API calls", ('status',))
+DB_QUERIES = Counter('db_queries_total', "Database queries executed")
+
+def timed(name):
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                SPAN_SECONDS.observe(time.perf_counter() - started, span=name)
+        return wrapper
+    return decorator
+
+@contextmanager
+def _span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_SECONDS.observe(time.perf_counter() - started, span=name)
+
+def span(name):
+    return _span(name) if METRICS_ENABLED else nullcontext()
+
+def record_strava_call(seconds, status):
+    STRAVA_CALLS.inc(status=status)
+    STRAVA_SECONDS.observe(seconds, status=status)
+    counts = request_counts.get()
+    if counts is not None:
+        counts['strava_calls'] += 1
+
+def record_db_query(*args):
+    DB_QUERIES.inc()
+    counts = request_counts.get()
+    if counts is not None:
+        counts['db_queries'] += 1
+
+def instrument_engine(engine):
+    if METRICS_ENABLED:
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', record_db_query)
+
+async def record_request(request, call_next):
+    counts = {'strava_calls': 0, 'db_queries': 0}
+    token = request_counts.set(counts)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        #szablon ścieżki zamiast URL, żeby identyfikatory w ścieżce nie mnożyły serii
+        route = getattr(request.scope.get('route'), 'path', 'unmatched')
+        REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route, status=status)
+        REQUEST_STRAVA_CALLS.observe(counts['strava_calls'], route=route)
+        REQUEST_DB_QUERIES.observe(counts['db_queries'], route=route)
+        request_counts.reset(token)
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,82 @@
+import sys
+import logging
+from datetime import date, datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.pool import StaticPool
+from models import Base
+
+def hot_queries():
+    #prawdziwe zapytania aplikacji z gorących ścieżek - EXPLAIN QUERY PLAN nie może pokazać dla nich pełnego skanu tabeli
+    import db_logic
+
+    start, end = datetime(2024, 1, 1), datetime(2024, 3, 1)
+    return {
+        'period activities': db_logic.get_period_activities(start, end, 1).statement,
+        'user activities': db_logic.get_user_activities(1),
+        'latest user activity': db_logic.latest_activity_date_query(1),
+        'activity details': db_logic.activity_row_query(1),
+        'activity laps': db_logic.lap_rows_query(1),
+        'user blocks': db_logic.get_user_blocks(1),
+        'weekly rollups': db_logic.get_weekly_rollups(start.date(), end.date(), 1),
+        'latest job': db_logic.latest_job_query(1, 'recompute'),
+    }
+
+def migrate(engine):
+    #dopasowanie istniejącej bazy do modeli: brakujące tabele, kolumny (nullable) i indeksy - bezpieczne przy każdym starcie
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                logging.info(f"Adding column {table.name}.{column.name}")
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+    for table in Base.metadata.sorted_tables:
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logging.info(f"Creating index {index.name}")
+                index.create(engine)
+
+    #połączenia w puli pamiętają schemat sprzed migracji - kolejne zapytania dostają świeże;
+    #jedynego połączenia bazy w pamięci nie można zamknąć, bo zniknęłaby razem z nim
+    if not isinstance(engine.pool, StaticPool):
+        engine.dispose()
+
+def query_plan(connection, stmt):
+    #zapytanie kompilowane jak w aplikacji, parametry w kolejności znaków zapytania
+    compiled = stmt.compile(dialect=connection.dialect)
+    params = tuple(plan_param(compiled.params[name]) for name in compiled.positiontup)
+    return [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)]
+
+def plan_param(value):
+    return value.isoformat(' ') if isinstance(value, datetime) else value.isoformat() if isinstance(value, date) else value
+
+def is_table_scan(detail):
+    return detail.startswith('SCAN') and 'INDEX' not in detail
+
+def find_table_scans(engine):
+    #tylko SQLite - dla innych silników zwraca pustą listę
+    if engine.dialect.name != 'sqlite':
+        return []
+    scans = []
+    with engine.connect() as connection:
+        for name, stmt in hot_queries().items():
+            scans.extend((name, detail) for detail in query_plan(connection, stmt) if is_table_scan(detail))
+    return scans
+
+if __name__ == "__main__":
+    from database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    migrate(engine)
+    if '--check' in sys.argv:
+        scans = find_table_scans(engine)
+        for name, detail in scans:
+            print(f"{name}: {detail}")
+        sys.exit(1 if scans else 0)
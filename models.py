@@ -1,6 +1,6 @@
 from sqlalchemy import Column, Integer, String, Float, DateTime, BigInteger, Boolean, Date
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import create_engine, ForeignKey
+from sqlalchemy import ForeignKey, Index
 Base = declarative_base()
 
 class Activity(Base):
@@ -8,6 +8,8 @@ class Activity(Base):
 
     activity_id = Column(BigInteger, primary_key=True, autoincrement=False)
     name = Column(String)
+    #nazwa z ostatniego pobrania ze Stravy - name może zostać zmienione lokalnie
+    strava_name = Column(String)
     type = Column(String)
     distance = Column(Float)
     time = Column(String)
@@ -23,6 +25,10 @@ class Activity(Base):
     user_id = Column(Integer, ForeignKey('users.user_id'))
     owner = relationship("User", back_populates="activities")
 
+    __table_args__ = (
+        Index('ix_activities_user_date', 'user_id', 'date'),
+    )
+
     def __repr__(self):
         return f"<Activity(name='{self.name}', type='{self.type}', date='{self.start_date}')>"
     
@@ -41,6 +47,10 @@ class Lap(Base):
 
     activity = relationship("Activity", back_populates="laps")
 
+    __table_args__ = (
+        Index('ix_laps_activity_lap_idx', 'activity_id', 'lap_idx'),
+    )
+
 class Block(Base):
     __tablename__ = 'blocks'
 
@@ -52,6 +62,10 @@ class Block(Base):
     user_id = Column(Integer, ForeignKey('users.user_id'))
     owner = relationship("User", back_populates="blocks")
 
+    __table_args__ = (
+        Index('ix_blocks_user_start', 'user_id', 'start_date'),
+    )
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -71,11 +85,58 @@ class User(Base):
 
     activities = relationship("Activity", back_populates="owner")
     blocks = relationship("Block", back_populates="owner")
+    sync_state = relationship("SyncState", back_populates="owner", uselist=False)
 
     def to_dict(self):
         return {column.name: getattr(self, column.name) for column in self.__table__.columns}
 
-def init_db(db_url="sqlite:///strava_data.db"):
-    engine = create_engine(db_url)
-    Base.metadata.create_all(engine)
-    return engine
\ No newline at end of file
+class SyncState(Base):
+    __tablename__ = 'sync_state'
+
+    user_id = Column(Integer, ForeignKey('users.user_id'), primary_key=True)
+    backfill_after = Column(Integer, nullable=True, default=None)  #data najnowszej aktywności zapisanej przez import historii
+    backfill_start = Column(Integer, nullable=True, default=None)  #zakres niedokończonego importu historii
+    backfill_end = Column(Integer, nullable=True, default=None)
+    last_synced_at = Column(Integer, nullable=True, default=None)  #data najnowszej aktywności zapisanej przez sync_latest
+
+    owner = relationship("User", back_populates="sync_state")
+
+class SyncJob(Base):
+    __tablename__ = 'sync_jobs'
+
+    #stan zadań w tle widoczny dla wszystkich workerów uvicorna
+    job_id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.user_id'))
+    kind = Column(String, nullable=False)
+    label = Column(String)
+    status = Column(String, nullable=False)
+    message = Column(String)
+    progress = Column(String)  #JSON
+    active_key = Column(String, unique=True, nullable=True)  #"<kind>:<user_id>" dopóki zadanie czeka lub trwa
+    created_at = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+    finished_at = Column(Float)
+
+    __table_args__ = (
+        Index('ix_sync_jobs_user_kind_created', 'user_id', 'kind', 'created_at'),
+    )
+
+class DataVersion(Base):
+    __tablename__ = 'data_versions'
+
+    #licznik zmian danych użytkownika - klucz dla cache widoków
+    user_id = Column(Integer, ForeignKey('users.user_id'), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class DailyRollup(Base):
+    __tablename__ = 'daily_rollups'
+
+    #sumy dzienne aktualizowane przy zapisie aktywności - źródło danych dla wykresów
+    user_id = Column(Integer, ForeignKey('users.user_id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    iso_year = Column(Integer, nullable=False)
+    iso_week = Column(Integer, nullable=False)
+    distance = Column(Float, nullable=False, default=0)
+    time_int = Column(Integer, nullable=False, default=0)
+    training_load = Column(Integer, nullable=False, default=0)
+    activity_count = Column(Integer, nullable=False, default=0)
\ No newline at end of file
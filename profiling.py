@@ -0,0 +1,126 @@
+import io
+import os
+import re
+import hmac
+import time
+import random
+import pstats
+import cProfile
+import functools
+import threading
+from contextvars import ContextVar
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+#profilowanie jest opt-in: wyłączone nie dodaje middleware, a @profiled zwraca funkcję bez zmian
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0').lower() in ('1', 'true', 'yes')
+SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0.01))
+THRESHOLD_MS = float(os.getenv('PROFILE_THRESHOLD_MS', 500))
+#domyślnie tylko wylosowane żądania są profilowane, więc wolne spoza próbki przepadają - PROFILE_ALL_REQUESTS=1
+#uruchamia cProfile przy każdym żądaniu i zapisuje każde ponad progiem, kosztem narzutu na wszystkich
+PROFILE_ALL_REQUESTS = os.getenv('PROFILE_ALL_REQUESTS', '0').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join('data', 'profiles'))
+MAX_PROFILES = int(os.getenv('PROFILE_MAX_FILES', 50))
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+
+#nazwa pliku: <czas w ms>-<czas trwania w ms>-<ścieżka>.prof
+PROFILE_NAME = re.compile(r'^(\d+)-(\d+)-([\w.-]+)\.prof$')
+
+#ustawiane przez middleware dla wylosowanych żądań, None gdy żądanie nie jest profilowane
+profile_request = ContextVar('profile_request', default=None)
+storage_lock = threading.Lock()
+
+async def select_request(request, call_next):
+    #cProfile działa na jednym wątku, a synchroniczne endpointy FastAPI wykonują się w puli wątków,
+    #więc middleware tylko oznacza żądanie, a profiler uruchamia @profiled w wątku endpointu
+    forced = valid_token(request.headers.get(PROFILE_HEADER))
+    if not forced and not PROFILE_ALL_REQUESTS and random.random() >= SAMPLE_RATE:
+        return await call_next(request)
+
+    token = profile_request.set({'forced': forced, 'path': request.url.path})
+    try:
+        return await call_next(request)
+    finally:
+        profile_request.reset(token)
+
+def valid_token(value):
+    #bez ustawionego PROFILE_TOKEN ani nagłówek X-Profile, ani podgląd profili nie działają
+    return bool(PROFILE_TOKEN) and value is not None and hmac.compare_digest(value.encode(), PROFILE_TOKEN.encode())
+
+def authorized(request):
+    #token w nagłówku X-Profile albo w parametrze ?token= (linki w przeglądarce)
+    return valid_token(request.headers.get(PROFILE_HEADER) or request.query_params.get('token'))
+
+def profiled(fn):
+    if not PROFILING_ENABLED:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        selected = profile_request.get()
+        if selected is None:
+            return fn(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            #od Pythona 3.12 aktywny może być tylko jeden profiler naraz
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            duration_ms = (time.perf_counter() - started) * 1000
+            if selected['forced'] or duration_ms >= THRESHOLD_MS:
+                save_profile(profiler, selected['path'], duration_ms)
+    return wrapper
+
+def save_profile(profiler, path, duration_ms):
+    slug = re.sub(r'[^\w.-]+', '_', path.strip('/')) or 'root'
+    name = f"{int(time.time() * 1000)}-{int(duration_ms)}-{slug[:80]}.prof"
+    with storage_lock:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+        #limit liczby plików - najstarsze profile są usuwane
+        for old in list_profiles()[MAX_PROFILES:]:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old['name']))
+            except OSError:
+                pass
+
+def list_profiles(limit=None):
+    #najnowsze najpierw
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        match = PROFILE_NAME.match(name)
+        if match:
+            created, duration_ms, path = match.groups()
+            profiles.append({
+                'name': name,
+                'created_at': int(created) / 1000,
+                'captured': datetime.fromtimestamp(int(created) / 1000).strftime('%Y-%m-%d %H:%M:%S'),
+                'duration_ms': int(duration_ms),
+                'path': '/' + path
+            })
+    profiles.sort(key=lambda profile: profile['created_at'], reverse=True)
+    return profiles[:limit] if limit else profiles
+
+def profile_report(name, sort='cumulative', lines=60):
+    if not PROFILE_NAME.match(name):
+        return None
+    file_path = os.path.join(PROFILE_DIR, name)
+    if not os.path.exists(file_path):
+        return None
+    output = io.StringIO()
+    stats = pstats.Stats(file_path, stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(lines)
+    return output.getvalue()
@@ -1,23 +1,32 @@
 from datetime import datetime
 from models import User
 import math
-import pandas as pd
-from db_logic import get_user_data, update_HRzones
+import numpy as np
+import logging
+import stream_store
+from metrics import timed
+from db_logic import get_user_activity_ids, update_training_loads, get_zone_settings
+
+RECOMPUTE_BATCH_SIZE = 200
 
 def process_laps_data(laps, streams):
-    result = []
+    boundaries = []
     lap_begin_distance = 0
     lap_end_distance = 0
     for lap in laps:
+        lap_end_distance += lap['distance']
+        boundaries.append((lap_begin_distance, lap_end_distance))
+        lap_begin_distance += lap['distance']
+    avg_hrs = calculate_laps_avg_hr(streams, boundaries)
+
+    result = []
+    for lap, avg_hr in zip(laps, avg_hrs):
         lap_id = lap['id']
         name = lap['name']
         time_int = lap['moving_time']
         time = time_toString(time_int)
         pace = calculate_pace(lap['moving_time'], lap['distance'])
         distance = lap['distance']
-        lap_end_distance += distance
-        avg_hr = calculate_lap_avg_hr(streams, lap_begin_distance, lap_end_distance)
-        lap_begin_distance += distance
 
         result_element= {
             'lap_id': lap_id,
@@ -31,7 +40,7 @@ def process_laps_data(laps, streams):
         result.append(result_element)
     return result
 
-def process_activity_data(activity, streams, ath_id):
+def process_activity_data(activity, streams, zones):
     activity_id = activity['id']
     name = activity['name']
     time_int = activity['moving_time']
@@ -51,7 +60,7 @@ def process_activity_data(activity, streams, ath_id):
         'pace': pace,
         'type': type,
         'date': start_date,
-        'training_load': calculate_TL(streams, ath_id)
+        'training_load': calculate_TL(streams, zones)
     }
     return result
 
@@ -71,53 +80,110 @@ def calculate_pace(time, distance):
     else:
         return 0
     
-def calculate_TL(streams, ath_id):
+@timed('calculate_TL')
+def calculate_TL(streams, zones):
 
-    ath_data = get_user_data(ath_id)
+    if not (zones and zones['z1_limit'] and zones['z2_limit'] and zones['z3_limit'] and zones['z4_limit'] and zones['hr_max']):
+        return 0
+    limits = [zones['z1_limit'], zones['z2_limit'], zones['z3_limit'], zones['z4_limit']]
+
+    if any(a > b for a, b in zip(limits, limits[1:])):
+        #searchsorted wymaga rosnących progów, dla nietypowych ustawień zostaje pętla
+        return calculate_TL_loop(streams['hr_data'], streams['time_data'], limits)
+    return calculate_TL_vectorized(streams['hr_data'], streams['time_data'], limits)
 
-    if not (ath_data['z1_limit'] and ath_data['z2_limit'] and ath_data['z3_limit'] and ath_data['z4_limit'] and ath_data['hr_max']):
+def calculate_TL_vectorized(hr_data, time_data, limits):
+    hr = np.asarray(hr_data)
+    if len(hr) < 2:
         return 0
+    time_arr = np.asarray(time_data[:len(hr)], dtype=np.int64)
+
+    delta_t = np.diff(time_arr) / 60 #here we need delta time in minutes
+    multipliers = np.searchsorted(limits, hr[1:], side='right') + 1
+    #cumsum sumuje po kolei jak pętla, więc wynik po int() jest identyczny
+    impulses = delta_t * multipliers
+    return int(np.cumsum(impulses)[-1])
+
+def calculate_TL_loop(hr_data, time_data, limits):
     def get_multiplier(hr):
-        if hr < ath_data['z1_limit']:
+        if hr < limits[0]:
             return 1
-        elif hr < ath_data['z2_limit']:
+        elif hr < limits[1]:
             return 2
-        elif hr < ath_data['z3_limit']:
+        elif hr < limits[2]:
             return 3
-        elif hr < ath_data['z4_limit']:
+        elif hr < limits[3]:
             return 4
         else: return 5
 
     tl = 0
-    for i in range(1, len(streams['hr_data'])):
-        delta_t = (streams['time_data'][i] - streams['time_data'][i-1]) / 60 #here we need delta time in minutes
-        curr_hr = streams['hr_data'][i]
+    for i in range(1, len(hr_data)):
+        delta_t = (time_data[i] - time_data[i-1]) / 60 #here we need delta time in minutes
+        curr_hr = hr_data[i]
         impulse = delta_t*get_multiplier(curr_hr)
         tl+=impulse
     return int(tl)
 
-def calculate_lap_avg_hr(streams, begin, end):
-    streams = convert_streams(streams)
-
-    data_dict = {}
-    for s in streams:
-        data_dict[s['type']] = s['data']
-
-    df = pd.DataFrame({k: pd.Series(v) for k, v in data_dict.items()})
-
-    if df['hr_data'].empty:
-        return 0
-    lap_data = df[(df['dist_data'] >= begin) & (df['dist_data'] <= end)]
-    if lap_data.empty:
-        return 0
-    avg = lap_data['hr_data'].mean()
-    if pd.isna(avg):
-        return 0
-    
-    return int(avg)
+def recompute_training_load(ath_id, progress=None, batch_size=RECOMPUTE_BATCH_SIZE):
+    #przelicza TL wszystkich aktywności z zapisanych lokalnie streamów - uruchamiane jako zadanie 'recompute' (jobs.py);
+    #strefy czytane z bazy przed każdą paczką, więc zmiana stref w trakcie (także w innym workerze) zaczyna od nowa
+    ath_id = int(ath_id)
+    progress = {} if progress is None else progress
+    while True:
+        zones = get_zone_settings(ath_id)
+        if recompute_with_zones(ath_id, zones, progress, batch_size) and get_zone_settings(ath_id) == zones:
+            break
+        logging.info(f"Heart rate zones of {ath_id} changed, restarting training load recompute")
+
+    message = f"Training load recalculated for {progress['updated']} activities."
+    if progress['missing']:
+        message += f" {progress['missing']} activities have no stored streams and kept their previous value."
+    return {'status': 'success', 'message': message}
+
+def recompute_with_zones(ath_id, zones, progress, batch_size):
+    #False, gdy strefy zmieniły się przed końcem przeliczania
+    activity_ids = get_user_activity_ids(ath_id)
+    progress.update(total=len(activity_ids), done=0, updated=0, missing=0)
+    for start in range(0, len(activity_ids), batch_size):
+        if start and get_zone_settings(ath_id) != zones:
+            return False
+        rows = []
+        for activity_id in activity_ids[start:start + batch_size]:
+            streams = stream_store.load_streams(activity_id)
+            if streams is None:
+                progress['missing'] += 1
+                continue
+            rows.append({'activity_id': activity_id, 'training_load': calculate_TL(streams, zones)})
+        update_training_loads(rows, ath_id)
+
+        progress['updated'] += len(rows)
+        progress['done'] = min(start + batch_size, len(activity_ids))
+    return True
+
+def calculate_laps_avg_hr(streams, boundaries):
+    #boundaries - lista (początek, koniec) okrążeń w metrach, liczona narastająco
+    n = min(len(streams['hr_data']), len(streams['dist_data']))
+    if n == 0 or not boundaries:
+        return [0] * len(boundaries)
+
+    dist = np.asarray(streams['dist_data'][:n], dtype=float)
+    hr = np.asarray(streams['hr_data'][:n], dtype=np.int64)
+    begins = np.array([begin for begin, _ in boundaries], dtype=float)
+    ends = np.array([end for _, end in boundaries], dtype=float)
+
+    if np.all(np.diff(dist) >= 0):
+        #dystans rośnie, więc każde okrążenie to ciągły przedział próbek
+        lo = np.searchsorted(dist, begins, side='left')
+        hi = np.searchsorted(dist, ends, side='right')
+        hr_cumsum = np.concatenate(([0], np.cumsum(hr)))
+        sums = hr_cumsum[hi] - hr_cumsum[lo]
+        counts = hi - lo
+    else:
+        masks = (dist >= begins[:, None]) & (dist <= ends[:, None])
+        sums = (masks * hr).sum(axis=1)
+        counts = masks.sum(axis=1)
 
-def convert_streams(streams):
-    return [{'type': 'dist_data', 'data': streams['dist_data']}, {'type': 'hr_data', 'data': streams['hr_data']}]
+    return [int(int(total) / int(count)) if count > 0 else 0 for total, count in zip(sums, counts)]
 
 def auto_calculate_zones(max_HR, rest_HR):
     if rest_HR:
@@ -0,0 +1,196 @@
+import os
+import time
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+#STRAVA_BASE_URL pozwala podpiąć lokalny serwer zastępczy zamiast prawdziwej Stravy
+BASE_URL = os.getenv('STRAVA_BASE_URL', 'https://www.strava.com').rstrip('/')
+API_URL = f"{BASE_URL}/api/v3"
+OAUTH_URL = f"{BASE_URL}/oauth"
+
+SHORT_LIMIT = int(os.getenv('STRAVA_SHORT_LIMIT', 200))
+DAILY_LIMIT = int(os.getenv('STRAVA_DAILY_LIMIT', 2000))
+MAX_RETRIES = int(os.getenv('STRAVA_MAX_RETRIES', 5))
+MAX_WAIT = float(os.getenv('STRAVA_MAX_WAIT', 900))
+POOL_SIZE = int(os.getenv('STRAVA_POOL_SIZE', 10))
+CONNECT_TIMEOUT = float(os.getenv('STRAVA_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.getenv('STRAVA_READ_TIMEOUT', 30))
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+class RateLimitExceeded(requests.RequestException):
+    pass
+
+def get_http_session():
+    #jedna sesja keep-alive na cały proces, współdzielona przez wszystkie zapytania
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+def close():
+    global _http_session
+    with _http_session_lock:
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
+
+#wspólna bramka zapytań do Stravy - limity 15-minutowy i dzienny z nagłówków X-RateLimit,
+#wstrzymanie przy wyczerpanym oknie i ponawianie 429/5xx z losowym wykładniczym opóźnieniem
+class RateLimitScheduler:
+    def __init__(self, short_limit=SHORT_LIMIT, daily_limit=DAILY_LIMIT, max_retries=MAX_RETRIES,
+                 backoff_base=1.0, backoff_max=60.0, max_wait=MAX_WAIT, clock=time.time, sleep=time.sleep):
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+        self.clock = clock
+        self.sleep = sleep
+
+        self.short_usage = 0
+        self.daily_usage = 0
+        self.short_window = None
+        self.daily_window = None
+        self.queue_depth = 0
+        self.retries = 0
+        self.condition = threading.Condition()
+
+    def request(self, method, url, **kwargs):
+        with self.condition:
+            self.queue_depth += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                self._acquire()
+                kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+                started = time.perf_counter()
+                response = get_http_session().request(method, url, **kwargs)
+                if metrics.METRICS_ENABLED:
+                    metrics.record_strava_call(time.perf_counter() - started, response.status_code)
+                self._update_usage(response.headers)
+
+                if response.status_code != 429 and response.status_code < 500:
+                    return response
+                if attempt == self.max_retries:
+                    return response
+
+                delay = self._retry_delay(attempt, response)
+                logging.warning(f"Strava returned {response.status_code} for {url}, retrying in {delay:.1f}s")
+                with self.condition:
+                    self.retries += 1
+                self.sleep(delay)
+        finally:
+            with self.condition:
+                self.queue_depth -= 1
+                self.condition.notify_all()
+
+    def status(self):
+        with self.condition:
+            self._roll_windows()
+            return {
+                'queue_depth': self.queue_depth,
+                'short_usage': self.short_usage,
+                'short_limit': self.short_limit,
+                'daily_usage': self.daily_usage,
+                'daily_limit': self.daily_limit,
+                'retries': self.retries
+            }
+
+    def _acquire(self):
+        with self.condition:
+            while True:
+                self._roll_windows()
+                if self.daily_usage >= self.daily_limit:
+                    raise RateLimitExceeded("Strava daily rate limit reached")
+                if self.short_usage < self.short_limit:
+                    #rezerwacja z góry - nagłówki odpowiedzi i tak nadpiszą licznik
+                    self.short_usage += 1
+                    self.daily_usage += 1
+                    return
+                wait = self._short_window_end() - self.clock()
+                if wait > self.max_wait:
+                    raise RateLimitExceeded("Strava 15-minute rate limit reached")
+                self.condition.release()
+                try:
+                    self.sleep(max(wait, 0) + 1)
+                finally:
+                    self.condition.acquire()
+
+    def _update_usage(self, headers):
+        limit = parse_rate_header(headers.get('X-RateLimit-Limit'))
+        usage = parse_rate_header(headers.get('X-RateLimit-Usage'))
+        with self.condition:
+            self._roll_windows()
+            if limit:
+                self.short_limit, self.daily_limit = limit
+            if usage:
+                self.short_usage, self.daily_usage = usage
+
+    def _retry_delay(self, attempt, response):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        if response.status_code == 429:
+            with self.condition:
+                if self.short_usage >= self.short_limit:
+                    return min(self._short_window_end() - self.clock() + 1, self.max_wait)
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.5)
+
+    def _roll_windows(self):
+        #Strava liczy okna od pełnych kwadransów i od północy UTC
+        now = self.clock()
+        short_window = int(now // 900)
+        daily_window = datetime.fromtimestamp(now, timezone.utc).date()
+        if short_window != self.short_window:
+            self.short_window = short_window
+            self.short_usage = 0
+        if daily_window != self.daily_window:
+            self.daily_window = daily_window
+            self.daily_usage = 0
+
+    def _short_window_end(self):
+        return (self.short_window + 1) * 900
+
+def parse_rate_header(value):
+    if not value:
+        return None
+    try:
+        short, daily = [int(part) for part in value.split(',')][:2]
+        return short, daily
+    except ValueError:
+        return None
+
+scheduler = RateLimitScheduler()
+
+#stan kolejki w /metrics, odczytywany przy każdym pobraniu metryk
+def scheduler_windows(usage_or_limit):
+    status = scheduler.status()
+    return {('short',): status[f'short_{usage_or_limit}'], ('daily',): status[f'daily_{usage_or_limit}']}
+
+metrics.Gauge('strava_scheduler_queue_depth', "Strava requests waiting for or holding a rate limit slot",
+              lambda: {(): scheduler.status()['queue_depth']})
+metrics.Gauge('strava_rate_usage', "Strava requests used in the current rate limit window",
+              lambda: scheduler_windows('usage'), ('window',))
+metrics.Gauge('strava_rate_limit', "Strava rate limit of the window", lambda: scheduler_windows('limit'), ('window',))
+
+def get(url, **kwargs):
+    return scheduler.request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return scheduler.request('POST', url, **kwargs)
@@ -1,10 +1,15 @@
 import os
 import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv, set_key
 import requests
+import strava_client as client
+import stream_store
+from metrics import timed
 from services import process_laps_data, process_activity_data
-from datetime import datetime
-from db_logic import insert_user
+from datetime import datetime, timedelta, timezone
+from db_logic import insert_user, insert_activity_data, get_activity_summaries, get_backfill_checkpoint, set_backfill_checkpoint, clear_backfill_checkpoint, get_sync_cursor, set_sync_cursor, get_latest_activity_date, get_zone_settings, get_access_token
 from fastapi import Response, responses
 import requests
 
@@ -13,6 +18,8 @@ load_dotenv()
 CLIENT_ID = os.getenv('STRAVA_CLIENT_ID')
 CLIENT_SECRET = os.getenv('STRAVA_CLIENT_SECRET')
 REDIRECT_URI = "http://127.0.0.1:8000/callback"
+MAX_WORKERS = int(os.getenv('STRAVA_MAX_WORKERS', 8))
+PER_PAGE = 50
     
 def authorization():
     #zakres
@@ -20,7 +27,7 @@ def authorization():
     
     #URL autoryzacyjny
     auth_url = (
-        f"https://www.strava.com/oauth/authorize?"
+        f"{client.OAUTH_URL}/authorize?"
         f"client_id={CLIENT_ID}&"
         f"redirect_uri={REDIRECT_URI}&"
         f"response_type=code&"
@@ -39,8 +46,8 @@ def callback_func(code):
     }
 
     #wysłanie zapytania 
-    url = "https://www.strava.com/oauth/token"
-    response = requests.post(url, data=payload)
+    url = f"{client.OAUTH_URL}/token"
+    response = client.post(url, data=payload)
     
     #sprawdzene kodu i wypisanie informacji
     if response.status_code == 200:
@@ -72,49 +79,242 @@ def callback_func(code):
     else:
         return {"error": "Code exchange error", "details": response.json()}
     
-def get_activities(start_date, end_date, access_token, ath_id):
-    after = int(datetime.strptime(start_date, "%Y-%m-%d").timestamp())
-    before = int(datetime.strptime(end_date, "%Y-%m-%d").timestamp())
+def filter_known_activities(activities, refresh_changed=False):
+    #jedno zapytanie do bazy na stronę - laps i streams pobierane tylko dla nowych aktywności,
+    #a w trybie refresh_changed także dla tych, których nazwa, dystans lub czas się zmieniły
+    summaries = get_activity_summaries(a['id'] for a in activities)
+    selected = []
+    for activity in activities:
+        summary = summaries.get(activity['id'])
+        if summary is None:
+            selected.append(activity)
+        elif refresh_changed and summary != (activity['name'], activity['distance'], activity['moving_time']):
+            selected.append(activity)
+    return selected
+
+def iter_activity_pages(access_token, after, before=None, per_page=PER_PAGE):
+    #generator - kolejne strony aktywności, aż Strava zwróci pustą listę
     headers = {
         'authorization': f'Bearer {access_token}'
     }
-    params = {
-        'after': after,
-        'before': before,
-        'per_page': 50
-    }
-    url = "https://www.strava.com/api/v3/athlete/activities"
-    response = requests.get(url,params=params, headers=headers)
+    url = f"{client.API_URL}/athlete/activities"
+    page = 1
+    while True:
+        params = {
+            'after': after,
+            'page': page,
+            'per_page': per_page
+        }
+        if before is not None:
+            params['before'] = before
+        response = client.get(url, params=params, headers=headers)
+        response.raise_for_status()
 
-    if response.status_code == 200:
         activities = response.json()
-        activities_array = []
-        laps_array = []
-        for activity in activities:
-            activity_id = activity['id']
-            laps_url = f"https://www.strava.com/api/v3/activities/{activity_id}/laps"
-            laps_response = requests.get(laps_url, params=params, headers=headers)
-            streams = get_streams(activity_id, access_token)
-            if laps_response.status_code == 200:
-                laps = laps_response.json()
-                laps_array.append(process_laps_data(laps, streams))
-            else:
+        if not activities:
+            return
+        yield activities
+        if len(activities) < per_page:
+            return
+        page += 1
+
+@timed('process_activities_page')
+def process_activities_page(activities, access_token, zones, max_workers=MAX_WORKERS, progress=None):
+    activities_array = []
+    laps_array = []
+    streams_by_id = {}
+    details = fetch_activities_details(activities, access_token, max_workers)
+    add_progress(progress, 'fetched', len(activities))
+    for activity, (laps_response, streams) in zip(activities, details):
+        #bez laps lub streams aktywność jest pomijana - zapis z zerowym obciążeniem i tętnem byłby trwały
+        if laps_response.status_code != 200:
+            logging.warning(f"Skipping activity {activity['id']}: laps request failed with {laps_response.status_code}")
+            continue
+        if streams is None:
+            continue
+        laps_array.append(process_laps_data(laps_response.json(), streams))
+        activities_array.append(process_activity_data(activity, streams, zones))
+        streams_by_id[activity['id']] = streams
+        add_progress(progress, 'processed', 1)
+    return activities_array, laps_array, streams_by_id
+
+@timed('save_page')
+def save_page(ath_id, activities, laps, streams_by_id, replace=False):
+    #streams trafiają na dysk dopiero po commicie, więc nieudany zapis nie zostawia osieroconych plików
+    result = insert_activity_data(activities, laps, int(ath_id), replace=replace)
+    if result['status'] == 'success':
+        for activity_id, streams in streams_by_id.items():
+            store_streams(activity_id, streams)
+    return result
+
+def backfill_activities(ath_id, access_token, start_date=None, end_date=None, max_workers=MAX_WORKERS, progress=None):
+    #bez 'before' Strava zwraca aktywności rosnąco po dacie, więc checkpoint
+    #(data najnowszej zapisanej aktywności) pozwala wznowić przerwany import tego samego zakresu
+    start = int(datetime.strptime(start_date, "%Y-%m-%d").timestamp()) if start_date else 0
+    before = int(datetime.strptime(end_date, "%Y-%m-%d").timestamp()) if end_date else None
+
+    after = start
+    checkpoint = get_backfill_checkpoint(ath_id)
+    if checkpoint is not None:
+        checkpoint_after, checkpoint_start, checkpoint_end = checkpoint
+        if (checkpoint_start, checkpoint_end) == (start, before):
+            after = checkpoint_after
+
+    def save_checkpoint(ath_id, timestamp):
+        set_backfill_checkpoint(ath_id, timestamp, start, before)
+
+    result = import_pages(ath_id, access_token, after, before, save_checkpoint, max_workers, progress)
+    if result['status'] == 'success':
+        clear_backfill_checkpoint(ath_id)
+    return result
+
+def sync_latest_activities(ath_id, access_token, max_workers=MAX_WORKERS, progress=None):
+    #kursor = data ostatniej zapisanej aktywności sportowca, bez niego startujemy od
+    #najnowszej aktywności w bazie (lub tydzień wstecz dla nowego konta)
+    after = get_sync_cursor(ath_id)
+    if after is None:
+        latest = get_latest_activity_date(ath_id)
+        if latest is not None:
+            after = int(latest.replace(tzinfo=timezone.utc).timestamp())
+        else:
+            after = int((datetime.now(timezone.utc) - timedelta(weeks=1)).timestamp())
+    return import_pages(ath_id, access_token, after, None, set_sync_cursor, max_workers, progress)
+
+@timed('import_pages')
+def import_pages(ath_id, access_token, after, before, save_cursor, max_workers=MAX_WORKERS, progress=None, refresh_changed=False):
+    #strony bez 'before' przychodzą rosnąco po dacie, więc po każdej zapisanej stronie
+    #save_cursor (jeśli podany) dostaje datę najnowszej aktywności i wznowienie zaczyna od niej
+    count = 0
+    updated = 0
+    skipped_count = 0
+    cursor_locked = False
+    zones = get_zone_settings(ath_id)
+    try:
+        for activities in iter_activity_pages(access_token, after):
+            if before is not None:
+                activities = [a for a in activities if activity_timestamp(a) < before]
+                if not activities:
+                    break
+            selected = filter_known_activities(activities, refresh_changed)
+            add_progress(progress, 'skipped', len(activities) - len(selected))
+            skipped_count += len(activities) - len(selected)
+            page_activities, page_laps, page_streams = process_activities_page(selected, access_token, zones, max_workers, progress)
+            result = save_page(ath_id, page_activities, page_laps, page_streams, replace=refresh_changed)
+            if result['status'] != 'success':
+                result['count'] = count
+                return result
+            count += result['count']
+            updated += result['updated']
+            skipped_count += result['skipped']
+            add_progress(progress, 'inserted', result['count'])
+            add_progress(progress, 'updated', result['updated'])
+            add_progress(progress, 'skipped', result['skipped'])
+
+            if save_cursor is None:
                 continue
-            activities_array.append(process_activity_data(activity, streams, ath_id))
-        return activities_array, laps_array
+
+            #pominięta aktywność (błąd laps lub streams) blokuje kursor, żeby kolejny import ją powtórzył
+            if not cursor_locked:
+                processed = {a['activity_id'] for a in page_activities}
+                skipped = [activity_timestamp(a) for a in selected if a['id'] not in processed]
+                if skipped:
+                    save_cursor(ath_id, min(skipped) - 1)
+                    cursor_locked = True
+                else:
+                    save_cursor(ath_id, max(activity_timestamp(a) for a in activities))
+    except requests.RequestException as e:
+        logging.error(f"Strava request error: {e}")
+        return {'status': 'error', 'message': str(e), 'count': count}
+    return {'status': 'success', 'message': "Completed", 'count': count, 'updated': updated, 'skipped': skipped_count}
+
+def sync_activities(ath_id, start_date, end_date, refresh_changed=False, progress=None):
+    #cały import w jednym miejscu - uruchamiany jako zadanie w tle (jobs.py)
+    token = get_access_token(int(ath_id))
+    if token is None:
+        return {'status': 'error', 'message': "Unable to get a valid Strava access token."}
+
+    #zapis strona po stronie - w pamięci są tylko streams bieżącej strony
+    after = int(datetime.strptime(start_date, "%Y-%m-%d").timestamp())
+    before = int(datetime.strptime(end_date, "%Y-%m-%d").timestamp())
+    result = import_pages(int(ath_id), token, after, before, None, progress=progress, refresh_changed=refresh_changed)
+    if result['status'] != 'success':
+        result['message'] = f"Upload interrupted after {result.get('count', 0)} activities: {result['message']}"
+        return result
+
+    result['message'] = f"Successfully uploaded {result['count']} new activities, {result['skipped']} were already saved."
+    if refresh_changed:
+        result['message'] += f" {result['updated']} changed activities were refreshed."
+    return result
+
+def sync_history(ath_id, start_date=None, end_date=None, progress=None):
+    token = get_access_token(int(ath_id))
+    if token is None:
+        return {'status': 'error', 'message': "Unable to get a valid Strava access token."}
+
+    result = backfill_activities(int(ath_id), token, start_date, end_date, progress=progress)
+    if result['status'] == 'success':
+        result['message'] = f"History import finished, {result['count']} activities saved."
     else:
-        return None
+        result['message'] = f"History import interrupted after {result.get('count', 0)} activities. Run it again to resume."
+    return result
+
+def sync_latest(ath_id, progress=None):
+    token = get_access_token(int(ath_id))
+    if token is None:
+        return {'status': 'error', 'message': "Unable to get a valid Strava access token."}
+
+    result = sync_latest_activities(int(ath_id), token, progress=progress)
+    if result['status'] == 'success':
+        result['message'] = f"Successfully uploaded {result['count']} new activities."
+    else:
+        result['message'] = f"Upload interrupted after {result.get('count', 0)} activities. Run it again to continue."
+    return result
+
+def add_progress(progress, key, amount):
+    if progress is not None:
+        progress[key] = progress.get(key, 0) + amount
+
+def store_streams(activity_id, streams):
+    try:
+        stream_store.save_streams(activity_id, streams)
+    except OSError as e:
+        logging.error(f"Cannot store streams of activity {activity_id}: {e}")
+
+def activity_timestamp(activity):
+    return int(datetime.fromisoformat(activity['start_date']).timestamp())
+
+@timed('fetch_activities_details')
+def fetch_activities_details(activities, access_token, max_workers=MAX_WORKERS):
+    #laps i streams pobierane równolegle, wynik w kolejności listy aktywności
+    if not activities:
+        return []
+    headers = {
+        'authorization': f'Bearer {access_token}'
+    }
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = []
+        for activity in activities:
+            activity_id = activity['id']
+            laps_url = f"{client.API_URL}/activities/{activity_id}/laps"
+            laps_future = executor.submit(client.get, laps_url, headers=headers)
+            streams_future = executor.submit(get_streams, activity_id, access_token)
+            futures.append((laps_future, streams_future))
+        return [(laps_future.result(), streams_future.result()) for laps_future, streams_future in futures]
     
+@timed('get_streams')
 def get_streams(activity_id, access_token):
-    url = f"https://www.strava.com/api/v3/activities/{activity_id}/streams"
+    url = f"{client.API_URL}/activities/{activity_id}/streams"
     headers = {'Authorization': f'Bearer {access_token}'}
     params = {'keys': 'heartrate,time,distance', 'key_by_type': 'true'}
 
-    response = requests.get(url, headers=headers, params=params)
+    response = client.get(url, headers=headers, params=params)
 
-    if response.status_code != 200:
-        print(f"Błąd pobierania streams: {response.status_code} - {response.text}")
+    #404 - aktywność bez streams (np. dodana ręcznie), inny błąd - None i aktywność jest pomijana
+    if response.status_code == 404:
         return {'hr_data': [], 'time_data': [], 'dist_data': []}
+    if response.status_code != 200:
+        logging.warning(f"Skipping activity {activity_id}: streams request failed with {response.status_code}")
+        return None
     data = response.json()
 
     # Używamy .get(), aby uniknąć błędu, jeśli tętno nie było rejestrowane
@@ -127,10 +327,10 @@ def get_streams(activity_id, access_token):
     return streams
 
 def get_athlete_data(access_token):
-    url = "https://www.strava.com/api/v3/athlete"
+    url = f"{client.API_URL}/athlete"
     headers = {'Authorization': f'Bearer {access_token}'}
 
-    response = requests.get(url, headers=headers)
+    response = client.get(url, headers=headers)
     if response.status_code == 200:
         athlete = response.json()
         return {
@@ -151,7 +351,7 @@ def ensure_access_token(user_data):
             'grant_type': 'refresh_token'
         }
 
-        response = requests.post("https://www.strava.com/oauth/token", data=payload)
+        response = client.post(f"{client.OAUTH_URL}/token", data=payload)
 
         if response.status_code == 200:
             response = response.json()
@@ -163,6 +363,7 @@ def ensure_access_token(user_data):
             return user_data
         
         else:
+            logging.error(f"Strava rejected token refresh: {response.status_code} {response.text[:200]}")
             return None
     else:
         return user_data
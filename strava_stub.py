@@ -0,0 +1,288 @@
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+#lokalny zamiennik Strava API do testów wydajności - uruchomienie aplikacji na nim:
+#STRAVA_BASE_URL=http://127.0.0.1:8001
+
+FIRST_ACTIVITY = datetime(2020, 1, 1, 6, 0, tzinfo=timezone.utc)
+RATE_WINDOW = 900
+
+#każdy sportowiec ma `activities` aktywności (jedna dziennie od FIRST_ACTIVITY) z `samples` próbkami
+#i `laps` okrążeniami, generowanymi z id aktywności - te same odpowiedzi przy każdym uruchomieniu;
+#tokeny "stub-<athlete_id>", limity short_limit/daily_limit zwracają 429 jak prawdziwe API
+class StravaStub:
+    def __init__(self, athletes=1, activities=100, samples=3600, laps=5, latency=0.0, jitter=0.0,
+                 short_limit=None, daily_limit=None, fail_streams=(), host='127.0.0.1', port=0):
+        self.athletes = athletes
+        self.activities = activities
+        self.samples = samples
+        self.laps = laps
+        self.latency = latency
+        self.jitter = jitter
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        #aktywności, dla których streams zwracają 500
+        self.fail_streams = set(fail_streams)
+        self.short_usage = 0
+        self.daily_usage = 0
+        self.short_window = None
+        self.daily_window = None
+        self.served = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), StubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="strava-stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {'served': self.served, 'throttled': self.throttled}
+
+    def count_request(self):
+        #zwraca False, gdy limit 15-minutowy lub dzienny jest wyczerpany
+        now = time.time()
+        with self.lock:
+            short_window = int(now // RATE_WINDOW)
+            daily_window = datetime.fromtimestamp(now, timezone.utc).date()
+            if short_window != self.short_window:
+                self.short_window, self.short_usage = short_window, 0
+            if daily_window != self.daily_window:
+                self.daily_window, self.daily_usage = daily_window, 0
+
+            self.served += 1
+            over_short = self.short_limit is not None and self.short_usage >= self.short_limit
+            over_daily = self.daily_limit is not None and self.daily_usage >= self.daily_limit
+            if over_short or over_daily:
+                self.throttled += 1
+                return False
+            self.short_usage += 1
+            self.daily_usage += 1
+            return True
+
+    def rate_headers(self):
+        if self.short_limit is None and self.daily_limit is None:
+            return {}
+        with self.lock:
+            return {
+                'X-RateLimit-Limit': f"{self.short_limit or 0},{self.daily_limit or 0}",
+                'X-RateLimit-Usage': f"{self.short_usage},{self.daily_usage}"
+            }
+
+    def athlete_id(self, authorization):
+        token = (authorization or '').removeprefix('Bearer ').strip()
+        if not token.startswith('stub-'):
+            return None
+        try:
+            ath_id = int(token[len('stub-'):])
+        except ValueError:
+            return None
+        return ath_id if 1 <= ath_id <= self.athletes else None
+
+    def activity_ids(self, ath_id):
+        return range(ath_id * 1_000_000, ath_id * 1_000_000 + self.activities)
+
+    def owner(self, activity_id):
+        ath_id, index = divmod(activity_id, 1_000_000)
+        if 1 <= ath_id <= self.athletes and index < self.activities:
+            return ath_id
+        return None
+
+    def streams(self, activity_id):
+        return generate_streams(activity_id, self.samples)
+
+    def activity_summary(self, activity_id):
+        index = activity_id % 1_000_000
+        time_data, _, dist_data = self.streams(activity_id)
+        start = FIRST_ACTIVITY + timedelta(days=index)
+        return {
+            'id': activity_id,
+            'name': f"Run {index + 1}",
+            'type': 'Run',
+            'distance': dist_data[-1] if dist_data else 0.0,
+            'moving_time': time_data[-1] if time_data else 0,
+            'start_date': start.strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+
+    def activity_laps(self, activity_id):
+        time_data, _, dist_data = self.streams(activity_id)
+        if not dist_data:
+            return []
+        bounds = [round(i * (len(dist_data) - 1) / self.laps) for i in range(self.laps + 1)]
+        laps = []
+        for lap_idx, (begin, end) in enumerate(zip(bounds, bounds[1:]), start=1):
+            laps.append({
+                'id': activity_id * 100 + lap_idx,
+                'name': f"Lap {lap_idx}",
+                'distance': round(dist_data[end] - dist_data[begin], 1),
+                'moving_time': time_data[end] - time_data[begin]
+            })
+        return laps
+
+    def list_activities(self, ath_id, after=None, before=None, page=1, per_page=30):
+        #jak w Stravie: tylko 'after' - rosnąco po dacie, w pozostałych przypadkach od najnowszej
+        summaries = []
+        for activity_id in self.activity_ids(ath_id):
+            start = (FIRST_ACTIVITY + timedelta(days=activity_id % 1_000_000)).timestamp()
+            if after is not None and start <= after:
+                continue
+            if before is not None and start >= before:
+                continue
+            summaries.append(activity_id)
+        if after is None or before is not None:
+            summaries.reverse()
+        offset = (page - 1) * per_page
+        return [self.activity_summary(activity_id) for activity_id in summaries[offset:offset + per_page]]
+
+    def token(self, refresh_token):
+        if not (refresh_token or '').startswith('stub-refresh-'):
+            return None
+        ath_id = refresh_token[len('stub-refresh-'):]
+        return {
+            'access_token': f"stub-{ath_id}",
+            'refresh_token': refresh_token,
+            'expires_at': int(time.time()) + 6 * 3600
+        }
+
+@lru_cache(maxsize=256)
+def generate_streams(activity_id, samples):
+    #1 Hz z losowymi przerwami, tętno faluje wokół 145 bpm, tempo ok. 3 m/s
+    rng = random.Random(activity_id)
+    time_data, hr_data, dist_data = [], [], []
+    t, distance = 0, 0.0
+    for _ in range(samples):
+        time_data.append(t)
+        hr_data.append(int(145 + 25 * math.sin(t / 600) + rng.gauss(0, 3)))
+        dist_data.append(round(distance, 1))
+        step = rng.choice((1, 1, 1, 2, 5))
+        t += step
+        distance += step * rng.uniform(2.6, 3.4)
+    return time_data, hr_data, dist_data
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def handle_request(self):
+        stub = self.server.stub
+        if stub.latency or stub.jitter:
+            time.sleep(max(0.0, stub.latency + random.uniform(-stub.jitter, stub.jitter)))
+        if not stub.count_request():
+            return self.send_json(429, {'message': 'Rate Limit Exceeded'})
+
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip('/').split('/')
+
+        if self.command == 'POST' and parts == ['oauth', 'token']:
+            length = int(self.headers.get('Content-Length') or 0)
+            form = {key: values[-1] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+            token = stub.token(form.get('refresh_token'))
+            if token is None:
+                return self.send_json(400, {'message': 'Bad Request'})
+            return self.send_json(200, token)
+
+        if self.command != 'GET' or parts[:2] != ['api', 'v3']:
+            return self.send_json(404, {'message': 'Record Not Found'})
+        ath_id = stub.athlete_id(self.headers.get('Authorization'))
+        if ath_id is None:
+            return self.send_json(401, {'message': 'Authorization Error'})
+        parts = parts[2:]
+
+        if parts == ['athlete']:
+            return self.send_json(200, {'id': ath_id, 'username': f"athlete{ath_id}", 'sex': 'M'})
+        if parts == ['athlete', 'activities']:
+            try:
+                activities = stub.list_activities(
+                    ath_id,
+                    after=int(query['after']) if 'after' in query else None,
+                    before=int(query['before']) if 'before' in query else None,
+                    page=int(query.get('page', 1)),
+                    per_page=int(query.get('per_page', 30))
+                )
+            except ValueError:
+                return self.send_json(400, {'message': 'Bad Request'})
+            return self.send_json(200, activities)
+        if len(parts) == 3 and parts[0] == 'activities' and parts[1].isdigit():
+            activity_id = int(parts[1])
+            if stub.owner(activity_id) != ath_id:
+                return self.send_json(404, {'message': 'Record Not Found'})
+            if parts[2] == 'laps':
+                return self.send_json(200, stub.activity_laps(activity_id))
+            if parts[2] == 'streams':
+                if activity_id in stub.fail_streams:
+                    return self.send_json(500, {'message': 'Internal Server Error'})
+                time_data, hr_data, dist_data = stub.streams(activity_id)
+                return self.send_json(200, {
+                    'time': {'data': time_data},
+                    'heartrate': {'data': hr_data},
+                    'distance': {'data': dist_data}
+                })
+        return self.send_json(404, {'message': 'Record Not Found'})
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in self.server.stub.rate_headers().items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Strava API stand-in")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--athletes', type=int, default=1)
+    parser.add_argument('--activities', type=int, default=100)
+    parser.add_argument('--samples', type=int, default=3600, help="stream samples per activity")
+    parser.add_argument('--laps', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--short-limit', type=int, default=None)
+    parser.add_argument('--daily-limit', type=int, default=None)
+    args = parser.parse_args()
+
+    stub = StravaStub(
+        athletes=args.athletes, activities=args.activities, samples=args.samples, laps=args.laps,
+        latency=args.latency, jitter=args.jitter, short_limit=args.short_limit, daily_limit=args.daily_limit,
+        host=args.host, port=args.port
+    )
+    print(f"Strava stub listening on {stub.url} (tokens: stub-1 .. stub-{args.athletes})")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
@@ -0,0 +1,53 @@
+import os
+import shutil
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STREAM_DIR = os.getenv('STREAM_STORE_DIR', os.path.join('data', 'streams'))
+
+#tętno mieści się w int16, czas w sekundach w uint32, dystans w metrach w float32
+STREAM_DTYPES = {
+    'hr_data': np.int16,
+    'time_data': np.uint32,
+    'dist_data': np.float32
+}
+
+def activity_path(activity_id):
+    return os.path.join(STREAM_DIR, str(int(activity_id)))
+
+def save_streams(activity_id, streams):
+    path = activity_path(activity_id)
+    tmp_path = path + ".tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    for key, dtype in STREAM_DTYPES.items():
+        np.save(os.path.join(tmp_path, f"{key}.npy"), np.asarray(streams.get(key, []), dtype=dtype))
+
+    #podmiana całego katalogu, żeby czytelnik nie trafił na niepełny zapis
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+def load_streams(activity_id, mmap=True):
+    path = activity_path(activity_id)
+    if not os.path.isdir(path):
+        return None
+    mmap_mode = 'r' if mmap else None
+    streams = {}
+    for key in STREAM_DTYPES:
+        file_path = os.path.join(path, f"{key}.npy")
+        if not os.path.exists(file_path):
+            return None
+        try:
+            streams[key] = np.load(file_path, mmap_mode=mmap_mode)
+        except ValueError:
+            #pustej tablicy nie da się zmapować
+            streams[key] = np.load(file_path)
+    return streams
+
+def has_streams(activity_id):
+    return os.path.isdir(activity_path(activity_id))
+
+def delete_streams(activity_id):
+    shutil.rmtree(activity_path(activity_id), ignore_errors=True)
@@ -0,0 +1,19 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+import db_logic
+from database import create_db_engine
+from migrations import migrate
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    #db_logic na osobnej bazie SQLite z jednym sportowcem
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    migrate(engine)
+    monkeypatch.setattr(db_logic, 'engine', engine)
+    monkeypatch.setattr(db_logic, 'SessionLocal', sessionmaker(bind=engine))
+    db_logic.insert_user({
+        'athlete_id': 1, 'name': 'athlete1', 'gender': 'M',
+        'access_token': 'stub-1', 'refresh_token': 'stub-refresh-1', 'expires_at': 0
+    })
+    yield engine
+    engine.dispose()
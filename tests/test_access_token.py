@@ -0,0 +1,20 @@
+import logging
+import requests
+from sqlalchemy.exc import OperationalError
+import db_logic
+
+def test_strava_error_is_logged_as_such(db, monkeypatch, caplog):
+    def refresh(ath_id):
+        raise requests.ConnectionError("connection refused")
+    monkeypatch.setattr(db_logic, 'refresh_access_token', refresh)
+    with caplog.at_level(logging.ERROR):
+        assert db_logic.get_access_token(1) is None
+    assert "Strava token refresh failed" in caplog.text
+
+def test_database_error_is_logged_as_such(db, monkeypatch, caplog):
+    def refresh(ath_id):
+        raise OperationalError("SELECT", {}, Exception("database is locked"))
+    monkeypatch.setattr(db_logic, 'refresh_access_token', refresh)
+    with caplog.at_level(logging.ERROR):
+        assert db_logic.get_access_token(1) is None
+    assert "Database error while refreshing token" in caplog.text
@@ -0,0 +1,11 @@
+from benchmarks import measure_sync
+
+#mała synchronizacja bez opóźnień - typowo ok. 60 aktywności/s, próg z dużym zapasem na wolne CI
+MIN_RATE = 10
+
+def test_sync_benchmark():
+    report = measure_sync(activities=40, samples=600, latency=0.0)
+    assert report['activities'] == 40
+    #lista aktywności + laps i streams dla każdej - więcej zapytań to regresja
+    assert report['requests'] == 1 + 2 * 40
+    assert report['rate'] >= MIN_RATE
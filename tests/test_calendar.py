@@ -0,0 +1,35 @@
+from datetime import datetime, date
+import pytest
+import data_analysis
+import db_logic
+from fragment_cache import fragment_cache, fragment_size
+
+@pytest.fixture
+def calendar(db, monkeypatch):
+    monkeypatch.setattr(data_analysis, 'engine', db)
+    fragment_cache.clear()
+    rows = [{
+        'activity_id': day, 'name': f"Run {day}", 'distance': 5000.0, 'time': '25:00', 'time_int': 1500,
+        'type': 'Run', 'date': datetime(2024, 1, day, 8), 'pace': '5:00', 'training_load': 50
+    } for day in range(1, 15)]
+    db_logic.insert_activity_data(rows, [[]] * len(rows), 1)
+    db_logic.add_Block('Base', date(2024, 1, 1), date(2024, 1, 7), 1)
+    yield
+    fragment_cache.clear()
+
+def test_calendar_model_lives_in_fragment_cache(calendar):
+    model = data_analysis.get_calendar_model(1)
+    key = ('calendar_model', 1, model['version'])
+    assert fragment_cache.get(key) is model
+    assert fragment_size(model) >= model['activities'].memory_usage(deep=True).sum()
+
+    blocks = data_analysis.get_calendar_blocks(1)
+    assert [block['name'] for block in blocks] == ['Base', 'Unassigned']
+    assert blocks[0]['html'].count('/show_details') == 7
+
+def test_calendar_model_dropped_with_athlete_data(calendar):
+    version = data_analysis.get_calendar_model(1)['version']
+    db_logic.rename(1, 'Long run')
+    model = data_analysis.get_calendar_model(1)
+    assert model['version'] != version
+    assert 'Long run' in data_analysis.get_calendar_blocks(1)[0]['html']
@@ -0,0 +1,18 @@
+from threading import Thread
+from sqlalchemy import text
+from database import create_db_engine
+from migrations import migrate
+
+def test_memory_database_shared_between_threads():
+    engine = create_db_engine('sqlite:///:memory:')
+    migrate(engine)
+    counts = []
+
+    def count_activities():
+        with engine.connect() as connection:
+            counts.append(connection.execute(text("SELECT count(*) FROM activities")).scalar())
+
+    thread = Thread(target=count_activities)
+    thread.start()
+    thread.join()
+    assert counts == [0]
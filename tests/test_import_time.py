@@ -0,0 +1,7 @@
+from benchmarks import measure_import_time
+
+def test_main_import_is_lazy():
+    #czas importu zależy od maszyny - budżet sprawdza `python benchmarks.py import_time`
+    modules, eager = measure_import_time('main')
+    assert 'main' in modules
+    assert eager == [], f"imported eagerly: {eager}"
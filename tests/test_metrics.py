@@ -0,0 +1,15 @@
+import metrics
+import strava_client
+
+def test_scheduler_state_in_metrics(monkeypatch):
+    scheduler = strava_client.RateLimitScheduler(short_limit=100, daily_limit=1000)
+    scheduler._roll_windows()
+    scheduler.queue_depth = 3
+    scheduler.short_usage, scheduler.daily_usage = 40, 400
+    monkeypatch.setattr(strava_client, 'scheduler', scheduler)
+
+    lines = metrics.render().splitlines()
+    assert 'strava_scheduler_queue_depth 3' in lines
+    assert 'strava_rate_usage{window="short"} 40' in lines
+    assert 'strava_rate_usage{window="daily"} 400' in lines
+    assert 'strava_rate_limit{window="short"} 100' in lines
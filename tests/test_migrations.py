@@ -0,0 +1,21 @@
+import pytest
+from database import create_db_engine
+from migrations import migrate, hot_queries, query_plan, is_table_scan, find_table_scans
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'plans.db'}")
+    migrate(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.mark.parametrize('name', sorted(hot_queries()))
+def test_hot_query_uses_index(engine, name):
+    with engine.connect() as connection:
+        plan = query_plan(connection, hot_queries()[name])
+    assert plan
+    assert not [detail for detail in plan if is_table_scan(detail)], plan
+
+def test_check_after_migrate(engine):
+    #ten sam silnik co migracja - jak w `python migrations.py --check`
+    assert find_table_scans(engine) == []
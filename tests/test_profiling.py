@@ -0,0 +1,55 @@
+import pytest
+from fastapi.testclient import TestClient
+import profiling
+from main import app
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILING_ENABLED', True)
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', 'secret')
+    return TestClient(app)
+
+def test_profiles_require_token(client):
+    assert client.get('/profiles').status_code == 403
+    assert client.get('/profiles', params={'token': 'wrong'}).status_code == 403
+    assert client.get('/profiles', params={'token': 'secret'}).status_code == 200
+    assert client.get('/profiles', headers={'X-Profile': 'secret'}).status_code == 200
+    assert client.get('/profiles/1-1-calendar.prof').status_code == 403
+
+def test_profiles_closed_without_token(client, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', '')
+    assert client.get('/profiles', params={'token': ''}).status_code == 403
+    assert not profiling.valid_token('')
+
+def test_profile_links_keep_token(client):
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.runcall(sum, range(10))
+    profiling.save_profile(profiler, '/calendar', 600)
+    page = client.get('/profiles', params={'token': 'secret'}).text
+    name = profiling.list_profiles()[0]['name']
+    assert f'/profiles/{name}?sort=tottime&amp;token=secret' in page
+    assert client.get(f'/profiles/{name}', params={'token': 'secret'}).status_code == 200
+
+def test_slow_requests_captured_outside_sample(tmp_path, monkeypatch):
+    from fastapi import FastAPI
+
+    monkeypatch.setattr(profiling, 'PROFILING_ENABLED', True)
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'SAMPLE_RATE', 0.0)
+    monkeypatch.setattr(profiling, 'THRESHOLD_MS', 0.0)
+    slow_app = FastAPI()
+    slow_app.middleware("http")(profiling.select_request)
+
+    @slow_app.get('/slow')
+    @profiling.profiled
+    def slow():
+        return {}
+
+    TestClient(slow_app).get('/slow')
+    assert profiling.list_profiles() == []
+
+    monkeypatch.setattr(profiling, 'PROFILE_ALL_REQUESTS', True)
+    TestClient(slow_app).get('/slow')
+    assert [profile['path'] for profile in profiling.list_profiles()] == ['/slow']
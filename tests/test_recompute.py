@@ -0,0 +1,84 @@
+import time
+import threading
+from datetime import datetime
+import pytest
+import db_logic
+import services
+import stream_store
+from jobs import JobManager
+
+ZONES = {'z1': 130, 'z2': 145, 'z3': 160, 'z4': 175, 'hr_max': 190}
+LOW_ZONES = {'z1': 100, 'z2': 110, 'z3': 120, 'z4': 130, 'hr_max': 190}
+
+@pytest.fixture
+def activities(db, tmp_path, monkeypatch):
+    #dwie aktywności z zapisanymi streams, tętno 150 przez godzinę
+    monkeypatch.setattr(stream_store, 'STREAM_DIR', str(tmp_path / 'streams'))
+    rows = [{
+        'activity_id': activity_id, 'name': 'Run', 'distance': 10000.0, 'time': '1:00:00', 'time_int': 3600,
+        'type': 'Run', 'date': datetime(2024, 1, activity_id, 8), 'pace': '6:00', 'training_load': 0
+    } for activity_id in (1, 2)]
+    db_logic.insert_activity_data(rows, [[], []], 1)
+    for row in rows:
+        stream_store.save_streams(row['activity_id'], {'hr_data': [150] * 3601, 'time_data': list(range(3601)), 'dist_data': []})
+    db_logic.update_HRzones(1, ZONES)
+    return [row['activity_id'] for row in rows]
+
+def training_loads(activity_ids):
+    return [db_logic.get_activity_row(activity_id).training_load for activity_id in activity_ids]
+
+def expected_load(zones):
+    limits = {f"{zone}_limit": zones[zone] for zone in ('z1', 'z2', 'z3', 'z4')}
+    return services.calculate_TL({'hr_data': [150] * 3601, 'time_data': list(range(3601))}, dict(limits, hr_max=zones['hr_max']))
+
+def test_recompute_updates_all_activities(activities):
+    progress = {}
+    result = services.recompute_training_load(1, progress)
+    assert result['status'] == 'success'
+    assert progress == {'total': 2, 'done': 2, 'updated': 2, 'missing': 0}
+    assert training_loads(activities) == [expected_load(ZONES)] * 2
+    assert expected_load(ZONES) > 0
+
+def test_zone_change_restarts_recompute(activities, monkeypatch):
+    update_training_loads = services.update_training_loads
+    calls = []
+
+    def update_and_change_zones(rows, ath_id):
+        #strefy zmienione w trakcie pierwszej paczki, np. przez inny worker
+        update_training_loads(rows, ath_id)
+        if not calls:
+            db_logic.update_HRzones(1, LOW_ZONES)
+        calls.append(rows)
+    monkeypatch.setattr(services, 'update_training_loads', update_and_change_zones)
+
+    services.recompute_training_load(1, batch_size=1)
+    assert len(calls) == 3
+    assert training_loads(activities) == [expected_load(LOW_ZONES)] * 2
+    assert expected_load(LOW_ZONES) != expected_load(ZONES)
+
+def test_recompute_status_visible_from_other_worker(activities):
+    started, release = threading.Event(), threading.Event()
+
+    def blocked_recompute(ath_id, progress=None):
+        started.set()
+        release.wait(10)
+        return services.recompute_training_load(ath_id, progress)
+
+    first, second = JobManager(), JobManager()
+    try:
+        job = first.submit('recompute', 1, blocked_recompute, 1)
+        started.wait(10)
+        #drugi worker nie uruchomi równoległego przeliczania tego samego sportowca
+        assert second.submit('recompute', 1, blocked_recompute, 1).job_id == job.job_id
+        assert second.latest('recompute', 1).status == 'running'
+
+        release.set()
+        deadline = time.time() + 10
+        while not job.finished and time.time() < deadline:
+            time.sleep(0.05)
+        status = second.latest('recompute', 1)
+        assert (status.job_id, status.status, status.progress['updated']) == (job.job_id, 'success', 2)
+    finally:
+        release.set()
+        first.shutdown()
+        second.shutdown()
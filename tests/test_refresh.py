@@ -0,0 +1,32 @@
+from datetime import datetime
+import db_logic
+from strava_services import filter_known_activities
+
+def activity(name, distance=5000.0, time_int=1500):
+    return {
+        'activity_id': 10, 'name': name, 'distance': distance, 'time': '25:00', 'time_int': time_int,
+        'type': 'Run', 'date': datetime(2024, 1, 1, 8), 'pace': '5:00', 'training_load': 50
+    }
+
+def summary(name, distance=5000.0, moving_time=1500):
+    return {'id': 10, 'name': name, 'distance': distance, 'moving_time': moving_time}
+
+def test_local_rename_is_not_a_change(db):
+    db_logic.insert_activity_data([activity('Morning Run')], [[]], 1)
+    db_logic.rename(10, 'Tempo 5k')
+    assert filter_known_activities([summary('Morning Run')], refresh_changed=True) == []
+
+def test_refresh_keeps_local_name(db):
+    db_logic.insert_activity_data([activity('Morning Run')], [[]], 1)
+    db_logic.rename(10, 'Tempo 5k')
+    assert filter_known_activities([summary('Morning Run', distance=5100.0)], refresh_changed=True)
+    db_logic.insert_activity_data([activity('Morning Run', distance=5100.0)], [[]], 1, replace=True)
+    row = db_logic.get_activity_row(10)
+    assert (row.name, row.distance) == ('Tempo 5k', 5100.0)
+
+def test_refresh_follows_strava_rename(db):
+    db_logic.insert_activity_data([activity('Morning Run')], [[]], 1)
+    assert filter_known_activities([summary('Parkrun')], refresh_changed=True)
+    db_logic.insert_activity_data([activity('Parkrun')], [[]], 1, replace=True)
+    assert db_logic.get_activity_row(10).name == 'Parkrun'
+    assert filter_known_activities([summary('Parkrun')], refresh_changed=True) == []
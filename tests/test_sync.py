@@ -0,0 +1,33 @@
+import pytest
+import db_logic
+import stream_store
+import strava_client
+import strava_services
+from strava_stub import StravaStub
+
+@pytest.fixture
+def stub(db, tmp_path, monkeypatch):
+    #import z lokalnego zamiennika Stravy, bez ponawiania błędów 5xx
+    stub = StravaStub(activities=10, samples=300).start()
+    monkeypatch.setattr(strava_client, 'API_URL', f"{stub.url}/api/v3")
+    monkeypatch.setattr(strava_client, 'scheduler', strava_client.RateLimitScheduler(max_retries=0))
+    monkeypatch.setattr(stream_store, 'STREAM_DIR', str(tmp_path / 'streams'))
+    yield stub
+    stub.stop()
+
+def test_failed_streams_skip_activity_and_hold_cursor(stub):
+    failing = 1_000_004
+    stub.fail_streams.add(failing)
+    result = strava_services.backfill_activities(1, 'stub-1')
+    assert result['status'] == 'success'
+    assert result['count'] == 9
+    assert db_logic.get_activity_row(failing) is None
+    assert not stream_store.has_streams(failing)
+
+    #checkpoint zatrzymany przed pominiętą aktywnością - kolejny import ją pobiera
+    stub.fail_streams.clear()
+    result = strava_services.backfill_activities(1, 'stub-1')
+    assert result['count'] == 1
+    assert db_logic.get_activity_row(failing) is not None
+    assert stream_store.has_streams(failing)
+    assert all(lap.avg_hr > 0 for lap in db_logic.get_lap_rows(failing))